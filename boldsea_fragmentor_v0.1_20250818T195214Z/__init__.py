@@ -7,6 +7,7 @@ schema-typed fragments for later insertion into Boldsea as Fragment:* models.
 Stages:
   1) ingest: read PDF/text to raw pages
   2) segment: make paragraph-like candidates with anchors
+     (optionally dedup: drop repeated headers/footers/boilerplate)
   3) classify: pick schema model via heuristics (LLM-ready interface)
   4) extract: schema-specific fields (heuristics now; pluggable LLM later)
   5) export: JSONL with attributes/relations per Boldsea ontology
@@ -14,4 +15,4 @@ Stages:
 This package does not call any external LLM by default. You can plug your client
 by implementing the LLMExtractor interface in extractor.py.
 """
-__all__ = ["schemas", "reader", "segmenter", "classifier", "extractor", "exporter"]
+__all__ = ["schemas", "parallel", "reader", "pagecache", "segmenter", "dedup", "classifier", "extractor", "exporter"]
@@ -0,0 +1,244 @@
+"""
+Benchmarks for the boldsea_fragmentor stages.
+
+    python -m boldsea_fragmentor.bench run --pages 200 --lang ru,en -o new.json
+    python -m boldsea_fragmentor.bench compare old.json new.json --threshold 0.10
+
+`run` generates a synthetic document (deterministic for a given seed), times
+each stage (read, segment, classify, extract, export) and the full
+pages -> predictions and pages -> JSONL paths, and prints machine-readable
+JSON. Every stage after segmentation runs on the candidates the segmenter
+produced from the synthetic pages, and rates are computed from the pages and
+fragments each stage actually handled (also reported per stage). Timings come from runs
+without tracing; peak Python allocations per stage come from a separate
+tracemalloc pass. `compare` diffs two result files and exits with status 1
+if any metric regressed by more than the threshold.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .reader import read_any
+from .segmenter import iter_segments, segment_pages
+from .classifier import classify_many
+from .extractor import extract_fields
+from .exporter import iter_envelopes, write_jsonl
+from .demo_run import predict_candidates
+
+_WORDS = {
+    "ru": ("система данные модель событие процесс значение объект правило вывод граф "
+           "узел связь пользователь сервис запрос ответ документ термин схема онтология "
+           "уровень контекст механизм задача результат структура элемент состояние").split(),
+    "en": ("system data model event process value object rule inference graph node link "
+           "user service request response document term schema ontology level context "
+           "mechanism task result structure element state").split(),
+}
+
+# Cue phrases that steer paragraphs into the different classifier branches.
+_CUES = {
+    "ru": ["{a} — это {b} {c}.", "{a} определяется как {b}.", "В отличие от {a}, {b} проще.",
+           "{a} приводит к {b}.", "Например, {a} и {b}.", "Компонент {a} отвечает за {b}.",
+           "Алгоритм: шаги {a} и {b}.", "Преимущества {a}: {b}. Недостатки: {c}.",
+           "Интеграция через API {a}.", "Сценарий: пользователь выполняет {a}."],
+    "en": ["{a} is a {b} for {c}.", "{a} refers to {b}.", "{a} vs {b}: {c} wins.",
+           "{a} results in {b}.", "For example, {a} with {b}.", "The {a} engine drives {b}.",
+           "The procedure applies {a} to {b}.", "The {a} framework implements {b}."],
+}
+
+def _sentence(rng: random.Random, lang: str) -> str:
+    w = _WORDS[lang]
+    if rng.random() < 0.4:
+        return rng.choice(_CUES[lang]).format(a=rng.choice(w), b=rng.choice(w), c=rng.choice(w))
+    words = [rng.choice(w) for _ in range(rng.randint(6, 16))]
+    return " ".join(words).capitalize() + "."
+
+def _paragraph(rng: random.Random, lang: str) -> str:
+    r = rng.random()
+    if r < 0.08:
+        return "\n".join(f"- {_sentence(rng, lang)}" for _ in range(rng.randint(2, 5)))
+    if r < 0.12:
+        w = _WORDS[lang]
+        return "\n".join(f"| {rng.choice(w)} | {rng.choice(w)} | {rng.randint(0, 99)} |" for _ in range(3))
+    if r < 0.15:
+        return "def handler(event):\n    return process(event);"
+    return " ".join(_sentence(rng, lang) for _ in range(rng.randint(2, 6)))
+
+def synthetic_document(pages: int, langs: List[str], paragraphs_per_page: int = 8,
+                       seed: int = 0) -> List[List[str]]:
+    """Pages of paragraphs; languages alternate per page."""
+    rng = random.Random(seed)
+    return [[_paragraph(rng, langs[i % len(langs)]) for _ in range(paragraphs_per_page)] for i in range(pages)]
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def _peak_alloc(fn: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def run_benchmarks(pages: int = 100, langs: Optional[List[str]] = None, paragraphs_per_page: int = 8,
+                   repeat: int = 3, seed: int = 0) -> Dict[str, Any]:
+    langs = langs or ["ru", "en"]
+    doc = synthetic_document(pages, langs, paragraphs_per_page, seed)
+    page_texts = [(i, "\n\n".join(paras)) for i, paras in enumerate(doc, start=1)]
+    # Every stage sees the same structure: the candidates the segmenter really
+    # produces from these pages, not the generator's paragraphs.
+    cands = segment_pages(page_texts)
+    texts = [c.text for c in cands]
+    classified = classify_many(texts)
+    preds = [{"schema": cls.schema.value, "text": c.text, "anchor": c.anchor, "confidence": cls.confidence}
+             for c, cls in zip(cands, classified)]
+    n_chars = sum(len(t) for _, t in page_texts)
+
+    tmpdir = tempfile.mkdtemp(prefix="boldsea_bench_")
+    doc_path = os.path.join(tmpdir, "doc.md")
+    with open(doc_path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(t for _, t in page_texts))
+    out_path = os.path.join(tmpdir, "out.jsonl")
+
+    def pipeline_jsonl() -> int:
+        write_jsonl(iter_envelopes(predict_candidates(iter_segments(page_texts)), "Document:Individual:bench"),
+                    out_path)
+        with open(out_path, "r", encoding="utf-8") as f:
+            return sum(1 for _ in f)
+
+    stages: Dict[str, Tuple[Callable[[], Any], Callable[[Any], Tuple[int, int]]]] = {
+        # name: (callable, output -> (pages processed, fragments produced))
+        "read": (lambda: read_any(doc_path), lambda out: (len(out), 0)),
+        "segment": (lambda: segment_pages(page_texts), lambda out: (len(page_texts), len(out))),
+        "classify": (lambda: classify_many(texts), lambda out: (0, len(out))),
+        "extract": (lambda: [extract_fields(cls.schema, t) for cls, t in zip(classified, texts)],
+                    lambda out: (0, len(out))),
+        "export": (lambda: write_jsonl(iter_envelopes(preds, "Document:Individual:bench"), out_path),
+                   lambda out: (0, len(preds))),
+        "pipeline": (lambda: list(predict_candidates(iter_segments(page_texts))),
+                     lambda out: (len(page_texts), len(out))),
+        "pipeline_jsonl": (pipeline_jsonl, lambda out: (len(page_texts), out)),
+    }
+    results: Dict[str, Any] = {}
+    try:
+        for name, (fn, counts) in stages.items():
+            seconds, out = _measure(fn, repeat)
+            n_pages, n_frags = counts(out)
+            res: Dict[str, Any] = {"seconds": round(seconds, 6), "pages": n_pages, "fragments": n_frags}
+            if n_pages:
+                res["pages_per_sec"] = round(n_pages / seconds, 3) if seconds else None
+            if n_frags:
+                res["fragments_per_sec"] = round(n_frags / seconds, 3) if seconds else None
+            res["chars_per_sec"] = round(n_chars / seconds, 1) if seconds else None
+            res["peak_alloc_bytes"] = _peak_alloc(fn)
+            results[name] = res
+    finally:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+    return {
+        "meta": {
+            "pages": pages,
+            "langs": langs,
+            "paragraphs": sum(len(paras) for paras in doc),
+            "candidates": len(cands),
+            "chars": n_chars,
+            "seed": seed,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ts": time.time(),
+        },
+        "stages": results,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+# metric -> True if higher is better
+_METRICS = {
+    "seconds": False,
+    "pages_per_sec": True,
+    "fragments_per_sec": True,
+    "chars_per_sec": True,
+    "peak_alloc_bytes": False,
+}
+
+def compare_results(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> Dict[str, Any]:
+    """Relative change of every shared metric; regressions are changes for the worse beyond threshold."""
+    rows: List[Dict[str, Any]] = []
+    for stage, new_res in new.get("stages", {}).items():
+        old_res = old.get("stages", {}).get(stage)
+        if not old_res:
+            continue
+        for metric, higher_is_better in _METRICS.items():
+            a, b = old_res.get(metric), new_res.get(metric)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = -change if higher_is_better else change
+            rows.append({"stage": stage, "metric": metric, "old": a, "new": b,
+                         "change": round(change, 4), "regression": worse > threshold})
+    return {"threshold": threshold, "rows": rows,
+            "regressions": [r for r in rows if r["regression"]]}
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="boldsea_fragmentor benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="Run the benchmark suite")
+    p_run.add_argument("--pages", type=int, default=100)
+    p_run.add_argument("--lang", default="ru,en", help="Comma-separated: ru,en")
+    p_run.add_argument("--paragraphs-per-page", type=int, default=8)
+    p_run.add_argument("--repeat", type=int, default=3)
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("-o", "--out", help="Write the JSON result here as well")
+    p_cmp = sub.add_parser("compare", help="Diff two result files")
+    p_cmp.add_argument("old")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="Relative change treated as a regression")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "run":
+        langs = [s.strip() for s in args.lang.split(",") if s.strip()]
+        for lang in langs:
+            if lang not in _WORDS:
+                parser.error(f"unsupported language: {lang}")
+        res = run_benchmarks(args.pages, langs, args.paragraphs_per_page, args.repeat, args.seed)
+        text = json.dumps(res, ensure_ascii=False, indent=2)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text)
+        print(text)
+        return 0
+
+    with open(args.old, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    diff = compare_results(old, new, args.threshold)
+    print(json.dumps(diff, ensure_ascii=False, indent=2))
+    return 1 if diff["regressions"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Tuple, List
+from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple
 import re
 from .schemas import SchemaType
 
@@ -35,8 +35,141 @@ RX = {
     "code": re.compile(r"```|\{{\}}|\bclass\b|\bdef\b|;\s*$|\bpublic\b|\bvoid\b|\bfunction\b", re.IGNORECASE),
 }
 
-def is_code_like(text: str) -> bool:
-    if RX["code"].search(text):
+def _split_alternatives(pattern: str) -> List[str]:
+    """Top-level alternatives of a regex source (``a|b(c|d)`` -> ``a``, ``b(c|d)``)."""
+    alts: List[str] = []
+    depth = 0
+    in_class = False
+    start = i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+            if pattern[i + 1:i + 2] == "]":
+                i += 1
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "|" and depth == 0:
+            alts.append(pattern[start:i])
+            start = i + 1
+        i += 1
+    alts.append(pattern[start:])
+    return alts
+
+_QUANT = re.compile(r"(?:[?*+]|\{(\d*),?(\d*)\})\??")
+_ZERO_WIDTH = "bBA"
+
+def _leading_literal(alt: str) -> str:
+    """Literal text every match of ``alt`` starts with (after zero-width anchors).
+
+    Scanning stops at the first group, class, wildcard or escape class; a
+    character made optional by a quantifier is dropped. An empty result means
+    the alternative has no literal anchor.
+    """
+    out: List[str] = []
+    i = 0
+    while i < len(alt):
+        ch = alt[i]
+        if ch == "^":
+            i += 1
+            continue
+        if ch in "([.$|)":
+            break
+        if ch == "\\":
+            nxt = alt[i + 1:i + 2]
+            if nxt and nxt in _ZERO_WIDTH:
+                i += 2
+                continue
+            if nxt.isalnum() or not nxt:
+                break
+            ch, i = nxt, i + 2
+        else:
+            i += 1
+        q = _QUANT.match(alt, i)
+        if q is not None and q.group()[0] == "{" and not (q.group(1) or q.group(2)):
+            q = None  # "{}" and "{,}" are literal braces
+        if q is None:
+            out.append(ch)
+            continue
+        if q.group()[0] == "+" or (q.group()[0] == "{" and int(q.group(1) or 0) > 0):
+            out.append(ch)
+        break
+    return "".join(out)
+
+def rx_triggers(patterns: Dict[str, Pattern[str]]) -> Dict[str, Optional[Tuple[str, ...]]]:
+    """Lowercase literals that must occur in a text for each pattern to fire.
+
+    Derived from the pattern sources, so editing an RX alternative updates its
+    trigger. None means some alternative has no literal anchor and the key is
+    always confirmed.
+    """
+    out: Dict[str, Optional[Tuple[str, ...]]] = {}
+    for key, rx in patterns.items():
+        lits = [_leading_literal(a).lower() for a in _split_alternatives(rx.pattern)]
+        out[key] = None if not all(lits) else tuple(dict.fromkeys(lits))
+    return out
+
+RX_TRIGGERS: Dict[str, Optional[Tuple[str, ...]]] = rx_triggers(RX)
+
+# Characters that re.IGNORECASE folds onto a trigger letter although str.lower()
+# does not (dotted/dotless i, long s, historic Cyrillic forms). Texts containing
+# them skip the literal prefilter and confirm every key.
+_FOLD_EXCEPTIONS = re.compile("[\u0130\u0131\u017f\u1c80-\u1c88\u212a]")
+
+class PatternMatcher:
+    """Single-pass matcher over the RX table.
+
+    All trigger literals are compiled into one alternation that is run once over
+    the lowercased text; only keys whose literal occurs are then confirmed with
+    their own RX pattern, so the set of fired keys is exactly what separate
+    ``RX[key].search`` calls would report.
+    """
+
+    def __init__(self, patterns: Dict[str, Pattern[str]], triggers: Dict[str, Optional[Tuple[str, ...]]]):
+        self.patterns = patterns
+        self.keys: Tuple[str, ...] = tuple(patterns)
+        self.always: Set[str] = {k for k in self.keys if not triggers.get(k)}
+        lit_keys: Dict[str, Set[str]] = {}
+        for key in self.keys:
+            for lit in triggers.get(key) or ():
+                lit_keys.setdefault(lit, set()).add(key)
+        # Longest literal wins at a given position; it also implies every
+        # shorter literal that is its prefix, so fold those keys in up front.
+        lits = sorted(lit_keys, key=lambda s: (-len(s), s))
+        self._lit_keys: Dict[str, Set[str]] = {
+            lit: set().union(*(lit_keys[p] for p in lits if lit.startswith(p))) for lit in lits
+        }
+        self._rx = re.compile("|".join(re.escape(lit) for lit in lits)) if lits else None
+
+    def candidates(self, text: str) -> Set[str]:
+        if self._rx is None or _FOLD_EXCEPTIONS.search(text):
+            return set(self.keys)
+        low = text.lower()
+        found = set(self.always)
+        pos = 0
+        while True:
+            m = self._rx.search(low, pos)
+            if m is None:
+                break
+            found |= self._lit_keys[m.group()]
+            pos = m.start() + 1
+        return found
+
+    def scan(self, text: str) -> Set[str]:
+        cand = self.candidates(text)
+        return {k for k in self.keys if k in cand and self.patterns[k].search(text)}
+
+_MATCHER = PatternMatcher(RX, RX_TRIGGERS)
+
+def _is_code_like(text: str, fired: Set[str]) -> bool:
+    if "code" in fired:
         return True
     letters = sum(ch.isalpha() for ch in text)
     nonspace = sum(not ch.isspace() for ch in text)
@@ -44,22 +177,36 @@ def is_code_like(text: str) -> bool:
         return True
     return False
 
+def is_code_like(text: str) -> bool:
+    return _is_code_like(text, {"code"} if RX["code"].search(text) else set())
+
 def classify_fragment(text: str) -> Classified:
     t = text.strip()
+    return _classify(t, _MATCHER.scan(t))
+
+def classify_many(texts: Iterable[str], matcher: Optional[PatternMatcher] = None) -> List[Classified]:
+    m = matcher or _MATCHER
+    out: List[Classified] = []
+    for text in texts:
+        t = text.strip()
+        out.append(_classify(t, m.scan(t)))
+    return out
+
+def _classify(t: str, fired: Set[str]) -> Classified:
     reasons: List[str] = []
 
-    if is_code_like(t):
+    if _is_code_like(t, fired):
         return Classified(schema=SchemaType.CODE_SNIPPET, confidence=0.95, reasons=["code-like"])
 
-    if RX["enumeration"].search(t) and len(t) < 2000:
+    if "enumeration" in fired and len(t) < 2000:
         reasons.append("bullet/numbered list")
         return Classified(schema=SchemaType.ENUMERATION, confidence=0.85, reasons=reasons)
 
-    if RX["table"].search(t):
+    if "table" in fired:
         reasons.append("table/matrix pattern")
         return Classified(schema=SchemaType.TABLE_ANALYSIS, confidence=0.8, reasons=reasons)
 
-    if RX["adv_disadv"].search(t):
+    if "adv_disadv" in fired:
         reasons.append("pros/cons lexemes")
         return Classified(schema=SchemaType.ADVANTAGE_DISADVANTAGE, confidence=0.8, reasons=reasons)
 
@@ -87,7 +234,7 @@ def classify_fragment(text: str) -> Classified:
     top_schema = SchemaType.UNKNOWN
     top_hits = 0
     for schema, key in checks:
-        if RX[key].search(t):
+        if key in fired:
             reasons.append(key)
             top_schema = schema
             top_hits += 1
@@ -0,0 +1,209 @@
+from __future__ import annotations
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+import re
+from .segmenter import FragmentCandidate
+
+_TOKEN = re.compile(r"\w+")
+_DIGITS = re.compile(r"\d+")
+
+@dataclass
+class Dropped:
+    page: int
+    anchor: str
+    duplicate_of: str  # anchor of the kept candidate
+    reason: str        # "exact" | "near" | "boilerplate"
+    similarity: float
+    text: str
+
+def _tokens(text: str, fold_digits: bool = False) -> List[str]:
+    # Folding digits makes running headers/footers that differ only by page
+    # number hash to the same key; it is only done for header-sized lines,
+    # since in body text the numbers are the content.
+    low = text.lower()
+    return _TOKEN.findall(_DIGITS.sub("0", low) if fold_digits else low)
+
+def _key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+_MASK64 = (1 << 64) - 1
+_MIX = 0x9E3779B97F4A7C15
+
+@lru_cache(maxsize=1 << 17)
+def _token_hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+def minhash(tokens: List[str], k: int = 32, shingle: int = 2) -> Tuple[int, ...]:
+    """k-value MinHash signature over word shingles.
+
+    Uses one-permutation hashing: every shingle is hashed once and lands in one
+    of k bins, each bin keeps its minimum, and empty bins borrow from the next
+    filled bin (rotation densification). Cost is linear in the number of tokens.
+    """
+    hs = [_token_hash(t) for t in tokens]
+    if len(hs) > shingle:
+        feats = set()
+        for i in range(len(hs) - shingle + 1):
+            h = 0
+            for x in hs[i:i + shingle]:
+                h = ((h ^ x) * _MIX) & _MASK64
+            feats.add(h)
+    else:
+        feats = set(hs)
+    empty = _MASK64 + 1
+    bins = [empty] * k
+    for h in feats:
+        i, v = h % k, h // k
+        if v < bins[i]:
+            bins[i] = v
+    if empty in bins and len(bins) > bins.count(empty):
+        filled = bins[:]
+        for i in range(k):
+            j = 0
+            while filled[(i + j) % k] == empty:
+                j += 1
+            if j:
+                bins[i] = filled[(i + j) % k] + j * (_MASK64 // k)
+    return tuple(bins)
+
+def _bands_for(threshold: float, k: int) -> Tuple[int, int]:
+    # Pick (bands, rows) with bands * rows == k whose LSH S-curve midpoint
+    # (1/bands) ** (1/rows) is the highest one not above the threshold.
+    best = (k, 1)
+    for rows in range(1, k + 1):
+        if k % rows:
+            continue
+        bands = k // rows
+        if (1.0 / bands) ** (1.0 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+class Deduplicator:
+    """Drops repeated page boilerplate and duplicate candidates, keeping the first occurrence.
+
+    strip_pages works on raw pages, before segmentation: short lines among the
+    first and last edge_lines non-empty lines of a page are running
+    headers/footers if the same line was already seen at the edge of an
+    earlier page, or if it differs only in digits (page numbers) from edge
+    lines of the recent pages (see strip_page); such lines are removed from
+    the page text.
+
+    filter works on candidates. Exact duplicates are found by hashing the
+    normalized text with digits kept. Near duplicates are candidates with at
+    least min_tokens tokens, the same numbers in the same order, and an
+    estimated Jaccard similarity of word shingles to a kept candidate
+    >= threshold. Kept MinHash signatures are indexed by LSH bands, so each
+    candidate is compared only with the few kept candidates sharing a band
+    and the pass stays roughly linear in the corpus size.
+    """
+
+    def __init__(self, threshold: float = 0.8, min_tokens: int = 8, num_perm: int = 32,
+                 edge_lines: int = 3, max_line_chars: int = 120):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.threshold = threshold
+        self.min_tokens = min_tokens
+        self.num_perm = num_perm
+        self.edge_lines = edge_lines
+        self.max_line_chars = max_line_chars
+        self.bands, self.rows = _bands_for(threshold, num_perm)
+        self._exact: Dict[bytes, str] = {}
+        self._lines: Dict[bytes, str] = {}
+        self._folded: Dict[bytes, Tuple[int, int, str]] = {}  # key -> (pages seen, last page, first anchor)
+        self._index: List[Dict[Tuple[int, ...], List[Tuple[Tuple[int, ...], Tuple[str, ...], str]]]] = [
+            {} for _ in range(self.bands)]
+        self.kept = 0
+        self.dropped: List[Dropped] = []
+
+    def strip_page(self, page_num: int, text: str) -> str:
+        """Returns the page text without header/footer lines repeated from earlier pages.
+
+        A line equal to an edge line of any earlier page is dropped. A line that
+        only matches with digits folded ("Страница 7") is dropped only when that
+        folded form was at the edge of at least two earlier pages, the latest
+        of them at most two pages back, so numbered headings ("Глава 2") that
+        appear now and then are kept.
+        """
+        lines = text.split("\n")
+        filled = [i for i, ln in enumerate(lines) if ln.strip()]
+        edge = filled[:self.edge_lines] + filled[-self.edge_lines:] if self.edge_lines > 0 else []
+        drop = set()
+        seen: Dict[bytes, str] = {}
+        seen_folded: Dict[bytes, str] = {}
+        for i in sorted(set(edge)):
+            line = lines[i].strip()
+            if len(line) > self.max_line_chars:
+                continue
+            key = _key(" ".join(_tokens(line)) or line)
+            folded = _key(" ".join(_tokens(line, fold_digits=True)) or line)
+            anchor = f"{page_num}:L{i}"
+            seen_folded.setdefault(folded, anchor)
+            first = self._lines.get(key)
+            if first is None:
+                run = self._folded.get(folded)
+                if run is not None and run[0] >= 2 and page_num - run[1] <= 2:
+                    first = run[2]
+            if first is not None:
+                drop.add(i)
+                self.dropped.append(Dropped(page_num, anchor, first, "boilerplate", 1.0, line[:200]))
+            else:
+                seen.setdefault(key, anchor)
+        # Lines of this page only count as boilerplate for later pages.
+        self._lines.update(seen)
+        for folded, anchor in seen_folded.items():
+            count, _, first = self._folded.get(folded, (0, 0, anchor))
+            self._folded[folded] = (count + 1, page_num, first)
+        if not drop:
+            return text
+        return "\n".join(ln for i, ln in enumerate(lines) if i not in drop)
+
+    def strip_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, str]]:
+        for page_num, text in pages:
+            yield page_num, self.strip_page(page_num, text)
+
+    def check(self, cand: FragmentCandidate) -> Optional[Dropped]:
+        """Returns a Dropped record if cand duplicates an earlier kept candidate, else registers it."""
+        tokens = _tokens(cand.text)
+        key = _key(" ".join(tokens) or cand.text.strip())
+        first = self._exact.get(key)
+        if first is not None:
+            return Dropped(cand.page, cand.anchor, first, "exact", 1.0, cand.text[:200])
+        if len(tokens) >= self.min_tokens:
+            nums = tuple(_DIGITS.findall(cand.text))
+            sig = minhash(tokens, self.num_perm)
+            keys = [sig[b * self.rows:(b + 1) * self.rows] for b in range(self.bands)]
+            best: Optional[Tuple[float, str]] = None
+            for idx, band in zip(self._index, keys):
+                for other, other_nums, anchor in idx.get(band, ()):
+                    if other_nums != nums:
+                        continue
+                    sim = sum(a == b for a, b in zip(sig, other)) / self.num_perm
+                    if sim >= self.threshold and (best is None or sim > best[0]):
+                        best = (sim, anchor)
+            if best is not None:
+                return Dropped(cand.page, cand.anchor, best[1], "near", round(best[0], 4), cand.text[:200])
+            for idx, band in zip(self._index, keys):
+                idx.setdefault(band, []).append((sig, nums, cand.anchor))
+        self._exact[key] = cand.anchor
+        self.kept += 1
+        return None
+
+    def filter(self, cands: Iterable[FragmentCandidate]) -> Iterator[FragmentCandidate]:
+        for c in cands:
+            d = self.check(c)
+            if d is None:
+                yield c
+            else:
+                self.dropped.append(d)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "kept": self.kept,
+            "dropped_exact": sum(1 for d in self.dropped if d.reason == "exact"),
+            "dropped_near": sum(1 for d in self.dropped if d.reason == "near"),
+            "dropped_boilerplate": sum(1 for d in self.dropped if d.reason == "boilerplate"),
+            "dropped": [asdict(d) for d in self.dropped],
+        }
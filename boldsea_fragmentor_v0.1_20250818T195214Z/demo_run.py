@@ -1,38 +1,144 @@
 from __future__ import annotations
-from typing import List, Dict, Any
-from .reader import read_any
-from .segmenter import segment_pages, FragmentCandidate
-from .classifier import classify_fragment
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import os
+from .reader import read_any, iter_any, iter_text_blocks
+from .pagecache import PageCache
+from .parallel import ordered_pool_map
+from .dedup import Deduplicator
+from .segmenter import segment_pages, iter_segments, iter_paragraphs, FragmentCandidate
+from .classifier import Classified, classify_fragment, classify_many
 from .extractor import extract_fields
 from .schemas import SchemaType
-from .exporter import build_envelopes, to_jsonl
+from .exporter import ExportManifest, FragmentEnvelope, iter_envelopes, write_jsonl
 
-def run_demo(path: str, max_pages: int = 3, max_frags: int = 60) -> Dict[str, Any]:
-    pages = read_any(path)
+def _predict(c: FragmentCandidate) -> Dict[str, Any]:
+    return _prediction(c, classify_fragment(c.text))
+
+def _predict_batch(cands: List[FragmentCandidate]) -> List[Dict[str, Any]]:
+    return [_prediction(c, cls) for c, cls in zip(cands, classify_many(c.text for c in cands))]
+
+def _prediction(c: FragmentCandidate, cls: Classified) -> Dict[str, Any]:
+    ext = extract_fields(cls.schema, c.text)
+    return {
+        "page": c.page,
+        "anchor": c.anchor,
+        "text": c.text[:5000],
+        "schema": cls.schema.value,
+        "confidence": round((cls.confidence + ext.confidence) / 2, 3),
+        "attributes": {},
+        "relations": ext.fields,
+    }
+
+def _init_worker() -> None:
+    # Importing the classifier compiles RX and the matcher; run one batch so the
+    # regex caches are warm before real work arrives.
+    _predict_batch([FragmentCandidate(page=0, anchor="", text="warm-up")])
+
+def _batched(items: Iterable[FragmentCandidate], size: int) -> Iterator[List[FragmentCandidate]]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def predict_candidates(cands: Iterable[FragmentCandidate], workers: int = 1,
+                       batch_size: int = 256) -> Iterator[Dict[str, Any]]:
+    """Classifies and extracts candidates, yielding predictions in input order.
+
+    With workers > 1, batches of batch_size candidates are shipped to a process
+    pool (workers <= 0 means one per CPU); the predictions are the same as on
+    the serial path. Batches the pool cannot handle are redone in-process.
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        for c in cands:
+            yield _predict(c)
+        return
+    for res in ordered_pool_map(_predict_batch, ((b,) for b in _batched(cands, max(1, batch_size))),
+                                workers, initializer=_init_worker):
+        yield from res
+
+def run_demo(path: str, max_pages: int = 3, max_frags: int = 60, pdf_workers: int = 1,
+             page_cache: Optional[PageCache] = None, workers: int = 1, batch_size: int = 256,
+             dedup: Optional[Deduplicator] = None) -> Dict[str, Any]:
+    pages = read_any(path, workers=pdf_workers, cache=page_cache)
     if max_pages and len(pages) > max_pages:
         pages = pages[:max_pages]
+    if dedup is not None:
+        pages = list(dedup.strip_pages(pages))
     cands: List[FragmentCandidate] = segment_pages(pages)
-    results = []
-    for c in cands[:max_frags]:
-        cls = classify_fragment(c.text)
-        ext = extract_fields(cls.schema, c.text)
-        results.append({
-            "page": c.page,
-            "anchor": c.anchor,
-            "text": c.text[:5000],
-            "schema": cls.schema.value,
-            "confidence": round((cls.confidence + ext.confidence) / 2, 3),
-            "attributes": {},
-            "relations": ext.fields,
-        })
-    return {
+    if dedup is not None:
+        cands = list(dedup.filter(cands))
+    results = list(predict_candidates(cands[:max_frags], workers=workers, batch_size=batch_size))
+    out = {
         "fragments": results,
         "pages_read": len(pages),
     }
+    if dedup is not None:
+        out["dedup"] = dedup.report()
+    return out
+
+def iter_predictions(path: str, max_pages: int = 0, max_frags: int = 0,
+                     pdf_workers: int = 1, page_cache: Optional[PageCache] = None,
+                     workers: int = 1, batch_size: int = 256,
+                     dedup: Optional[Deduplicator] = None) -> Iterator[Dict[str, Any]]:
+    """Streaming counterpart of run_demo: reader -> segmenter -> classifier -> extractor.
+
+    Pages are pulled lazily, so memory stays flat with respect to document size.
+    A zero limit means "no limit". With dedup, repeated page headers/footers
+    are stripped before segmentation and duplicate candidates are dropped
+    before classification; everything dropped is in dedup.report().
+    """
+    if os.path.splitext(path)[1].lower() == ".pdf":
+        pages = iter_any(path, workers=pdf_workers, cache=page_cache)
+        if max_pages:
+            pages = islice(pages, max_pages)
+        if dedup is not None:
+            pages = dedup.strip_pages(pages)
+        cands = iter_segments(pages)
+    else:
+        # Text inputs are a single page; map the file and segment it block by block.
+        cands = iter_paragraphs(1, iter_text_blocks(path))
+    if dedup is not None:
+        cands = dedup.filter(cands)
+    if max_frags:
+        cands = islice(cands, max_frags)
+    return predict_candidates(cands, workers=workers, batch_size=batch_size)
+
+def iter_fragments(path: str, document_ref: Optional[str] = None, max_pages: int = 0, max_frags: int = 0,
+                   actor: str = "system", pdf_workers: int = 1,
+                   page_cache: Optional[PageCache] = None, workers: int = 1,
+                   batch_size: int = 256, dedup: Optional[Deduplicator] = None) -> Iterator[FragmentEnvelope]:
+    if document_ref is None:
+        document_ref = "Document:Individual:" + os.path.splitext(os.path.basename(path))[0]
+    preds = iter_predictions(path, max_pages=max_pages, max_frags=max_frags, pdf_workers=pdf_workers,
+                             page_cache=page_cache, workers=workers, batch_size=batch_size, dedup=dedup)
+    return iter_envelopes(preds, document_ref=document_ref, actor=actor)
+
+def export_jsonl(results: Dict[str, Any], document_ref: str, out_path: str,
+                 manifest_path: Optional[str] = None) -> str:
+    """With manifest_path, only envelopes that are new or changed since the last export are written."""
+    _write_envelopes(iter_envelopes(results["fragments"], document_ref=document_ref), out_path, manifest_path)
+    return out_path
+
+def _write_envelopes(envs: Iterable[FragmentEnvelope], out_path: str, manifest_path: Optional[str]) -> None:
+    if manifest_path is None:
+        write_jsonl(envs, out_path)
+        return
+    manifest = ExportManifest(manifest_path)
+    write_jsonl(manifest.filter(envs), out_path)
+    manifest.save()
 
-def export_jsonl(results: Dict[str, Any], document_ref: str, out_path: str) -> str:
-    envs = build_envelopes(results["fragments"], document_ref=document_ref)
-    jsl = to_jsonl(envs)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(jsl)
+def stream_jsonl(path: str, out_path: str, document_ref: Optional[str] = None,
+                 max_pages: int = 0, max_frags: int = 0, pdf_workers: int = 1,
+                 page_cache: Optional[PageCache] = None, workers: int = 1, batch_size: int = 256,
+                 manifest_path: Optional[str] = None, dedup: Optional[Deduplicator] = None) -> str:
+    """Runs iter_fragments and writes every envelope to out_path as it is produced."""
+    envs = iter_fragments(path, document_ref=document_ref, max_pages=max_pages, max_frags=max_frags,
+                          pdf_workers=pdf_workers, page_cache=page_cache, workers=workers, batch_size=batch_size,
+                          dedup=dedup)
+    _write_envelopes(envs, out_path, manifest_path)
     return out_path
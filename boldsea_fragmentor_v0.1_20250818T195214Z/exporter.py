@@ -1,7 +1,14 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 from datetime import datetime
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import tempfile
 import uuid
 
 @dataclass
@@ -19,12 +26,13 @@ class FragmentEnvelope:
     created_at: str
 
 def to_jsonl(envelopes: List[FragmentEnvelope]) -> str:
-    import json
     return "\n".join(_to_event_payload(env) for env in envelopes)
 
 def _to_event_payload(env: FragmentEnvelope) -> str:
-    import json
-    event = {
+    return json.dumps(_to_event(env), ensure_ascii=False)
+
+def _to_event(env: FragmentEnvelope) -> Dict[str, Any]:
+    return {
         "SetModel": f"Fragment: Model: {env.model_identifier}",
         "Document": env.document_ref,
         "Attributes": {
@@ -43,13 +51,28 @@ def _to_event_payload(env: FragmentEnvelope) -> str:
             "created_at": env.created_at,
         },
     }
-    return json.dumps(event, ensure_ascii=False)
+
+# Namespace for uuid5 event ids; changing it re-keys every exported event.
+EVENT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "boldsea:fragment-event")
+
+def content_event_id(document_ref: str, anchor: str, schema: str, text: str) -> str:
+    """Deterministic event id: the same fragment of the same document always gets the same id."""
+    return str(uuid.uuid5(EVENT_NAMESPACE, "\x1f".join((document_ref, anchor, schema, text))))
+
+def payload_digest(env: FragmentEnvelope) -> str:
+    """Digest of everything an envelope carries except EventMeta (id, actor, timestamp)."""
+    event = _to_event(env)
+    del event["EventMeta"]
+    data = json.dumps(event, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
 
 def build_envelopes(predictions, document_ref: str, actor: str = "system") -> List[FragmentEnvelope]:
+    return list(iter_envelopes(predictions, document_ref, actor=actor))
+
+def iter_envelopes(predictions: Iterable[Dict[str, Any]], document_ref: str, actor: str = "system") -> Iterator[FragmentEnvelope]:
     now = datetime.utcnow().isoformat() + "Z"
-    envs: List[FragmentEnvelope] = []
     for p in predictions:
-        envs.append(FragmentEnvelope(
+        yield FragmentEnvelope(
             model_identifier=p["schema"],
             document_ref=document_ref,
             text=p["text"],
@@ -58,8 +81,104 @@ def build_envelopes(predictions, document_ref: str, actor: str = "system") -> Li
             relations=p.get("relations", {}),
             attributes=p.get("attributes", {}),
             confidence=p.get("confidence", 0.0),
-            event_id=str(uuid.uuid4()),
+            event_id=content_event_id(document_ref, p["anchor"], p["schema"], p["text"]),
             actor=actor,
             created_at=now
-        ))
-    return envs
+        )
+
+def write_jsonl(envelopes: Iterable[FragmentEnvelope], out_path: str, compression: Optional[str] = None,
+                flush_every: int = 10000, buffer_size: int = 1 << 20) -> int:
+    """Streams envelopes to out_path, one JSON event per line; returns the number of lines.
+
+    compression is "gzip", "xz" or "none"; by default it follows the ".gz"/".xz"
+    suffix of out_path. Lines go to a temporary file next to out_path, flushed
+    every flush_every lines, which is renamed over out_path only once all
+    envelopes are written, so an interrupted run leaves no partial output.
+    """
+    comp = _compression_for(out_path, compression)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(out_path) + ".", suffix=".tmp",
+                               dir=os.path.dirname(os.path.abspath(out_path)))
+    n = 0
+    try:
+        with open(fd, "wb", buffering=buffer_size) as raw:
+            if comp == "gzip":
+                sink = gzip.GzipFile(fileobj=raw, mode="wb")
+            elif comp == "xz":
+                sink = lzma.LZMAFile(raw, "wb")
+            else:
+                sink = raw
+            f = io.TextIOWrapper(sink, encoding="utf-8", newline="\n")
+            for env in envelopes:
+                f.write(_to_event_payload(env))
+                f.write("\n")
+                n += 1
+                if flush_every and n % flush_every == 0:
+                    f.flush()
+            f.flush()
+            if f.detach() is not raw:
+                sink.close()  # writes the compressed stream trailer; raw stays open
+            raw.flush()
+            os.fsync(raw.fileno())
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return n
+
+def _compression_for(out_path: str, compression: Optional[str]) -> str:
+    if compression is None:
+        ext = os.path.splitext(out_path)[1].lower()
+        return {".gz": "gzip", ".xz": "xz"}.get(ext, "none")
+    if compression not in ("gzip", "xz", "none"):
+        raise ValueError(f"Unsupported compression: {compression}")
+    return compression
+
+class ExportManifest:
+    """Event ids (and payload digests) written by previous exports of a document.
+
+    filter() passes through only envelopes that are new or whose payload changed
+    since the manifest was saved, and remembers every envelope it saw; save()
+    then replaces the stored set with the current one. Ids that disappeared are
+    listed in stats["removed"].
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous: Dict[str, str] = {}
+        self.current: Dict[str, str] = {}
+        self.stats: Dict[str, Any] = {"new": 0, "changed": 0, "unchanged": 0, "removed": []}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.previous = json.load(f).get("events", {})
+
+    def filter(self, envelopes: Iterable[FragmentEnvelope]) -> Iterator[FragmentEnvelope]:
+        for env in envelopes:
+            digest = payload_digest(env)
+            self.current[env.event_id] = digest
+            old = self.previous.get(env.event_id)
+            if old == digest:
+                self.stats["unchanged"] += 1
+                continue
+            self.stats["changed" if old is not None else "new"] += 1
+            yield env
+
+    def save(self) -> None:
+        self.stats["removed"] = sorted(set(self.previous) - set(self.current))
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp",
+                                   dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "events": self.current}, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,123 @@
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "boldsea_fragmentor", "pages.sqlite")
+
+def file_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class PageCache:
+    """On-disk cache of extracted page text, keyed by file content hash (plus an
+    extractor variant, see doc_key) and page number.
+
+    Entries live in a single SQLite file. When the stored text exceeds max_bytes
+    the least recently used pages are evicted. hits/misses count pages served
+    from the cache and pages that had to be extracted.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS pages (doc TEXT, page INTEGER, text TEXT, size INTEGER, atime REAL,"
+            " PRIMARY KEY (doc, page));"
+            "CREATE INDEX IF NOT EXISTS pages_atime ON pages (atime);"
+            "CREATE TABLE IF NOT EXISTS docs (doc TEXT PRIMARY KEY, n_pages INTEGER);"
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, doc TEXT);"
+        )
+
+    def doc_key(self, path: str, variant: str = "") -> str:
+        """Content hash of path, suffixed with variant (e.g. the extractor versions) if given.
+
+        Re-hashing is skipped while size and mtime are unchanged.
+        """
+        ap = os.path.abspath(path)
+        st = os.stat(ap)
+        row = self._db.execute("SELECT size, mtime_ns, doc FROM files WHERE path = ?", (ap,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            doc = row[2]
+        else:
+            doc = file_hash(ap)
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                 (ap, st.st_size, st.st_mtime_ns, doc))
+        return f"{doc}:{variant}" if variant else doc
+
+    def get_document(self, doc: str) -> Optional[List[Tuple[int, str]]]:
+        """All pages of doc in order, or None unless every page is cached."""
+        row = self._db.execute("SELECT n_pages FROM docs WHERE doc = ?", (doc,)).fetchone()
+        if row is None:
+            return None
+        pages = self._db.execute("SELECT page, text FROM pages WHERE doc = ? ORDER BY page", (doc,)).fetchall()
+        if len(pages) != row[0]:
+            return None
+        with self._db:
+            self._db.execute("UPDATE pages SET atime = ? WHERE doc = ?", (time.time(), doc))
+        self.hits += len(pages)
+        return [(p, t) for p, t in pages]
+
+    def put_page(self, doc: str, page: int, text: str) -> None:
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                             (doc, page, text, len(text.encode("utf-8")), time.time()))
+
+    def put_document(self, doc: str, n_pages: int) -> None:
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO docs VALUES (?, ?)", (doc, n_pages))
+        self.evict()
+
+    def cached_pages(self, doc: str, pages: Iterable[Tuple[int, str, bool]]) -> Iterator[Tuple[int, str]]:
+        """Passes extracted (page, text, ok) pages through as (page, text), storing each ok one.
+
+        The page count is recorded at the end only if every page was ok, so a
+        document with a failed page is extracted again next time.
+        """
+        n = 0
+        complete = True
+        for page_num, text, ok in pages:
+            self.misses += 1
+            if ok:
+                self.put_page(doc, page_num, text)
+            else:
+                complete = False
+            n += 1
+            yield (page_num, text)
+        if complete:
+            self.put_document(doc, n)
+
+    def evict(self) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        with self._db:
+            cur = self._db.execute("SELECT doc, page, size FROM pages ORDER BY atime")
+            doomed = []
+            for doc, page, size in cur:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((doc, page))
+                total -= size
+            self._db.executemany("DELETE FROM pages WHERE doc = ? AND page = ?", doomed)
+        self.evictions += len(doomed)
+
+    def stats(self) -> Dict[str, int]:
+        pages, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "pages": pages, "bytes": size}
+
+    def close(self) -> None:
+        self._db.close()
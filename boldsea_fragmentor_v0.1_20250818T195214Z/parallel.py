@@ -0,0 +1,58 @@
+from __future__ import annotations
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Deque, Iterable, Iterator, Optional, Tuple
+
+def ordered_pool_map(fn: Callable[..., Any], tasks: Iterable[Tuple[Any, ...]], workers: int,
+                     initializer: Optional[Callable[[], None]] = None) -> Iterator[Any]:
+    """Yields fn(*task) for every task, in task order, computed on a process pool.
+
+    At most workers * 2 tasks are in flight, so results do not pile up when the
+    consumer is slower than the pool. Any pool failure falls back to running in
+    process: if the pool cannot start, every task runs locally; if a submit
+    fails (e.g. BrokenProcessPool) the pool is dropped and that task and all
+    later ones run locally; a task whose result raises is redone locally.
+    fn must be picklable (a module-level function).
+    """
+    ex = None
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        ex = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+    except Exception:
+        ex = None
+    pending: Deque[Tuple[Tuple[Any, ...], Any]] = deque()
+
+    def submit(task: Tuple[Any, ...]) -> None:
+        nonlocal ex
+        fut = None
+        if ex is not None:
+            try:
+                fut = ex.submit(fn, *task)
+            except Exception:
+                ex.shutdown(wait=False)
+                ex = None
+        pending.append((task, fut))
+
+    todo = iter(tasks)
+    try:
+        for task in islice(todo, max(1, workers * 2)):
+            submit(task)
+        while pending:
+            task, fut = pending.popleft()
+            nxt = next(todo, None)
+            if nxt is not None:
+                submit(nxt)
+            if fut is not None:
+                try:
+                    res = fut.result()
+                except Exception:
+                    fut = None
+            if fut is None:
+                res = fn(*task)
+            yield res
+    finally:
+        for _, fut in pending:
+            if fut is not None:
+                fut.cancel()
+        if ex is not None:
+            ex.shutdown()
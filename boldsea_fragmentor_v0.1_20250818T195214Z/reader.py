@@ -1,38 +1,168 @@
 from __future__ import annotations
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Tuple
 import os
+from .parallel import ordered_pool_map
+
+if TYPE_CHECKING:
+    from .pagecache import PageCache
 
 def read_text_file(path: str) -> List[Tuple[int, str]]:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         txt = f.read()
     return [(1, txt)]
 
-def read_pdf(path: str) -> List[Tuple[int, str]]:
-    pages: List[Tuple[int, str]] = []
+def iter_text_blocks(path: str, block_size: int = 1 << 22) -> Iterator[str]:
+    """Decodes a text file block by block from a memory map.
+
+    Blocks are cut after a blank line (or at least a newline) where possible.
+    Decoding matches read_text_file: UTF-8 with errors ignored and universal
+    newlines, so "".join(iter_text_blocks(p)) == read_text_file(p)[0][1].
+    """
+    import codecs
+    import io
+    import mmap
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(errors="ignore"), translate=True)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            while pos < size:
+                end = min(size, pos + block_size)
+                if end < size:
+                    cut = mm.rfind(b"\n\n", pos, end)
+                    if cut != -1:
+                        end = cut + 2
+                    else:
+                        cut = mm.rfind(b"\n", pos, end)
+                        if cut != -1:
+                            end = cut + 1
+                text = decoder.decode(mm[pos:end], final=end == size)
+                if text:
+                    yield text
+                pos = end
+
+# (page_num, text, ok): ok is False for the "" placeholder of a page whose
+# extraction failed, so callers can tell it from a genuinely empty page.
+Page = Tuple[int, str, bool]
+
+def read_pdf(path: str, workers: int = 1) -> List[Tuple[int, str]]:
+    return list(iter_pdf(path, workers=workers))
+
+def iter_pdf(path: str, workers: int = 1) -> Iterator[Tuple[int, str]]:
+    """Yields (page_num, text) in page order.
+
+    With workers > 1 the page range is split across a process pool, each worker
+    opening its own reader; workers <= 0 means one per CPU. If the pool cannot
+    be started the pages are extracted serially. Pages that fail to extract
+    come back as "".
+    """
+    return ((i, text) for i, text, _ in iter_pdf_pages(path, workers=workers))
+
+def pdf_extractor_id() -> str:
+    """Names and versions of the installed PDF text extractors (part of the page cache key)."""
+    parts = []
+    for name in ("PyPDF2", "pdfminer"):
+        try:
+            mod = __import__(name)
+        except Exception:
+            continue
+        parts.append(f"{name}={getattr(mod, '__version__', '?')}")
+    return ";".join(parts) or "none"
+
+def iter_pdf_pages(path: str, workers: int = 1) -> Iterator[Page]:
+    """Like iter_pdf, but yields (page_num, text, ok) with ok False for failed pages."""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
     try:
         import PyPDF2
-        reader = PyPDF2.PdfReader(path)
-        for i, page in enumerate(reader.pages, start=1):
-            try:
-                text = page.extract_text() or ""
-            except Exception:
-                text = ""
-            pages.append((i, text))
-        return pages
+        pages = PyPDF2.PdfReader(path).pages
+        n = len(pages)
     except Exception:
-        pass
+        pages = None
+    if pages is not None:
+        if workers > 1 and n > 1:
+            yield from _iter_parallel(_pypdf2_range, path, n, workers)
+        else:
+            yield from _pypdf2_texts(pages, 1, n + 1)
+        return
+    n = _pdfminer_page_count(path)
+    if n is None:
+        yield (1, "", False)
+        return
+    if workers > 1 and n > 1:
+        yield from _iter_parallel(_pdfminer_range, path, n, workers)
+    else:
+        yield from _pdfminer_range(path, 1, n + 1)
+
+def _pypdf2_texts(pages, start: int, stop: int) -> Iterator[Page]:
+    for i in range(start, stop):
+        try:
+            yield (i, pages[i - 1].extract_text() or "", True)
+        except Exception:
+            yield (i, "", False)
+
+def _pypdf2_range(path: str, start: int, stop: int) -> List[Page]:
     try:
-        from pdfminer.high_level import extract_text
-        txt = extract_text(path) or ""
-        return [(1, txt)]
+        import PyPDF2
+        pages = PyPDF2.PdfReader(path).pages
+    except Exception:
+        return [(i, "", False) for i in range(start, stop)]
+    return list(_pypdf2_texts(pages, start, stop))
+
+def _pdfminer_page_count(path: str) -> Optional[int]:
+    try:
+        from pdfminer.pdfpage import PDFPage
+        with open(path, "rb") as fp:
+            return sum(1 for _ in PDFPage.get_pages(fp))
+    except Exception:
+        return None
+
+def _pdfminer_range(path: str, start: int, stop: int) -> List[Page]:
+    out: List[Page] = []
+    try:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        for i, layout in enumerate(extract_pages(path, page_numbers=range(start - 1, stop - 1)), start=start):
+            out.append((i, "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer)), True))
     except Exception:
         pass
-    return [(1, "")]
+    out.extend((i, "", False) for i in range(start + len(out), stop))
+    return out
 
-def read_any(path: str) -> List[Tuple[int, str]]:
+def _iter_parallel(extract: Callable[[str, int, int], List[Page]], path: str, n: int,
+                   workers: int) -> Iterator[Page]:
+    step = max(1, -(-n // (workers * 4)))
+    ranges = [(s, min(n + 1, s + step)) for s in range(1, n + 1, step)]
+    for chunk in ordered_pool_map(extract, ((path, s, e) for s, e in ranges), workers):
+        yield from chunk
+
+def read_any(path: str, workers: int = 1, cache: Optional[PageCache] = None) -> List[Tuple[int, str]]:
     ext = os.path.splitext(path)[1].lower()
     if ext in (".txt", ".md", ".rst"):
         return read_text_file(path)
     if ext == ".pdf":
-        return read_pdf(path)
+        if cache is not None:
+            return list(iter_any(path, workers=workers, cache=cache))
+        return read_pdf(path, workers=workers)
     return read_text_file(path)
+
+def iter_any(path: str, workers: int = 1, cache: Optional[PageCache] = None) -> Iterator[Tuple[int, str]]:
+    """Like read_any, but yields pages one by one instead of building a list.
+
+    With a PageCache, PDF pages of an unchanged file are served from the cache
+    without opening the PDF at all; otherwise they are extracted and stored.
+    The cache key includes pdf_extractor_id(), so upgrading an extractor
+    re-extracts, and pages that failed to extract are never stored.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        if cache is None:
+            return iter_pdf(path, workers=workers)
+        doc = cache.doc_key(path, variant=pdf_extractor_id())
+        pages = cache.get_document(doc)
+        if pages is not None:
+            return iter(pages)
+        return cache.cached_pages(doc, iter_pdf_pages(path, workers=workers))
+    return iter(read_text_file(path))
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 import re
 
 @dataclass
@@ -10,18 +10,57 @@ class FragmentCandidate:
     text: str
 
 def normalize_text(s: str) -> str:
+    return _normalize_runs(s).strip()
+
+def _normalize_runs(s: str) -> str:
+    # Every rule only rewrites a run of whitespace, so pieces of a text that end
+    # on a non-space character can be normalized independently (see iter_paragraphs).
     s = s.replace("\u00A0", " ").replace("\xa0", " ")
     s = re.sub(r"[ \t]+", " ", s)
     s = re.sub(r"\s+\n", "\n", s)
     s = re.sub(r"\n{3,}", "\n\n", s)
-    return s.strip()
+    return s
+
+_PARA_SPLIT = re.compile(r"\n\s*\n")
 
 def split_into_paragraphs(page_num: int, page_text: str) -> List[FragmentCandidate]:
     txt = normalize_text(page_text)
     if not txt:
         return []
-    chunks = re.split(r"\n\s*\n", txt)
-    frags: List[FragmentCandidate] = []
+    return list(_paragraphs(page_num, _PARA_SPLIT.split(txt)))
+
+def iter_paragraphs(page_num: int, blocks: Iterable[str]) -> Iterator[FragmentCandidate]:
+    """Incremental split_into_paragraphs over a page delivered in blocks.
+
+    Yields exactly what split_into_paragraphs(page_num, "".join(blocks)) returns
+    (same texts and anchors) while holding only the paragraph in progress.
+    """
+    return _paragraphs(page_num, _iter_chunks(blocks))
+
+def _iter_chunks(blocks: Iterable[str]) -> Iterator[str]:
+    carry = ""  # trailing whitespace run; it may continue in the next block
+    partial: List[str] = []
+    started = False
+    for block in blocks:
+        s = carry + block
+        body = s.rstrip()
+        carry = s[len(body):]
+        if not body:
+            continue
+        body = _normalize_runs(body)
+        if not started:
+            body = body.lstrip()
+            started = True
+        parts = _PARA_SPLIT.split(body)
+        partial.append(parts[0])
+        if len(parts) > 1:
+            yield "".join(partial)
+            yield from parts[1:-1]
+            partial = [parts[-1]]
+    if started:
+        yield "".join(partial)
+
+def _paragraphs(page_num: int, chunks: Iterable[str]) -> Iterator[FragmentCandidate]:
     offset = 0
     for ch in chunks:
         ch = ch.strip()
@@ -37,12 +76,12 @@ def split_into_paragraphs(page_num: int, page_text: str) -> List[FragmentCandida
             offset += len(ch) + 2
             continue
         anchor = f"{page_num}:{offset}-{offset+len(ch)}"
-        frags.append(FragmentCandidate(page=page_num, anchor=anchor, text=para))
+        yield FragmentCandidate(page=page_num, anchor=anchor, text=para)
         offset += len(ch) + 2
-    return frags
 
 def segment_pages(pages: List[Tuple[int, str]]) -> List[FragmentCandidate]:
-    result: List[FragmentCandidate] = []
+    return list(iter_segments(pages))
+
+def iter_segments(pages: Iterable[Tuple[int, str]]) -> Iterator[FragmentCandidate]:
     for page_num, page_text in pages:
-        result.extend(split_into_paragraphs(page_num, page_text))
-    return result
+        yield from split_into_paragraphs(page_num, page_text)
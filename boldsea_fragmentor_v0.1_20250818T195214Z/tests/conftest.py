@@ -0,0 +1,12 @@
+import importlib.util
+import os
+import sys
+
+# The package directory carries a version suffix; register it under its import name.
+_PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "boldsea_fragmentor" not in sys.modules:
+    _spec = importlib.util.spec_from_file_location(
+        "boldsea_fragmentor", os.path.join(_PKG_DIR, "__init__.py"), submodule_search_locations=[_PKG_DIR])
+    _mod = importlib.util.module_from_spec(_spec)
+    sys.modules["boldsea_fragmentor"] = _mod
+    _spec.loader.exec_module(_mod)
@@ -0,0 +1,35 @@
+import random
+import re
+
+from boldsea_fragmentor import classifier
+from boldsea_fragmentor.classifier import RX, PatternMatcher, rx_triggers
+
+def _texts():
+    lits = [lit for v in classifier.RX_TRIGGERS.values() if v for lit in v]
+    alpha = list("abcxyz АБВабвгдеёжз|{};`\n-•*1.)") + lits + [lit.upper() for lit in lits] + [" это ", "- ", "\n1. "]
+    rng = random.Random(0)
+    texts = ["", "Компонент движок обеспечивает интеграцию через API.", "def f(x):\n    return x;",
+             "- один\n- два", "| a | b | c |", "Results in a failure due to load.", "Это — определение."]
+    texts += ["".join(rng.choice(alpha) for _ in range(rng.randint(0, 30))) for _ in range(3000)]
+    return texts
+
+def test_scan_matches_plain_rx_search():
+    for text in _texts():
+        assert classifier._MATCHER.scan(text) == {k for k, rx in RX.items() if rx.search(text)}, text
+
+def test_triggers_follow_rx_edits():
+    patterns = dict(RX)
+    patterns["application"] = re.compile(RX["application"].pattern + r"|\bdeployed (in|on)\b", re.IGNORECASE)
+    triggers = rx_triggers(patterns)
+    assert "deployed " in triggers["application"]
+    assert "application" in PatternMatcher(patterns, triggers).scan("It is deployed on edge nodes.")
+
+def test_leading_literal():
+    lit = classifier._leading_literal
+    assert lit(r"\bresults? in\b") == "result"
+    assert lit(r"\bшаг(и)?\b") == "шаг"
+    assert lit(r"\be\.g\.\b") == "e.g."
+    assert lit(r"\|.*\|") == "|"
+    assert lit(r"(^|\n)[\-•\*] +") == ""
+    assert lit(r"ab{0,2}c") == "a"
+    assert lit(r"ab+c") == "ab"
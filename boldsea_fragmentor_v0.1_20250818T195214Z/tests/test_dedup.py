@@ -0,0 +1,58 @@
+from boldsea_fragmentor.dedup import Deduplicator
+from boldsea_fragmentor.segmenter import FragmentCandidate, segment_pages
+
+_BODIES = [
+    "Онтология задаёт типы событий и связи между ними.\n\nГраф хранит каждое событие как узел с атрибутами.",
+    "Сервис принимает запрос пользователя и возвращает документ.\n\nОшибки журналируются отдельно от ответа.",
+    "Правило вывода срабатывает, когда условие выполнено.\n\nРезультат записывается в контекст задачи.",
+    "Модель описывает состояние объекта во времени.\n\nКаждое изменение оформляется новым событием.",
+    "Схема фрагмента определяет набор обязательных полей.\n\nНеобязательные поля заполняются по мере анализа.",
+]
+
+def _pages():
+    return [(i, f"ООО «Болдси» — Руководство пользователя\n{body}\nКонфиденциально. Страница {i} из 5")
+            for i, body in enumerate(_BODIES, start=1)]
+
+def test_shared_header_footer_does_not_drop_pages():
+    dedup = Deduplicator()
+    cands = list(dedup.filter(segment_pages(list(dedup.strip_pages(_pages())))))
+    assert [c.page for c in cands] == [1, 2, 3, 4, 5]
+    for c, body in zip(cands, _BODIES):
+        assert body.split("\n\n")[1] in c.text
+    rep = dedup.report()
+    assert rep["dropped_exact"] == rep["dropped_near"] == 0
+    # the header repeats verbatim from page 2 on; the numbered footer once it ran on two pages
+    assert rep["dropped_boilerplate"] == 4 + 3
+    assert all("Руководство" not in c.text for c in cands[1:])
+    assert all("Конфиденциально" not in c.text for c in cands[2:])
+
+def test_numbered_headings_survive():
+    dedup = Deduplicator()
+    topics = "событий графа схем правил узлов связей запросов ответов сервисов документов терминов онтологий".split()
+    pages = []
+    for i, topic in enumerate(topics, start=1):
+        top = f"Глава {i // 4 + 1}" if i % 4 == 1 else "ООО «Болдси» — Руководство пользователя"
+        body = f"Здесь описана модель {topic}.\n\nПодробности — в следующем разделе про {topic}."
+        pages.append((i, f"{top}\n{body}\n{i}"))
+    out = dict(dedup.strip_pages(pages))
+    for i in (1, 5, 9):
+        assert out[i].startswith(f"Глава {i // 4 + 1}\n")
+    # bare page numbers at the bottom are a running footer from the third page on
+    assert all(not out[i].endswith(f"\n{i}") for i in range(3, 13))
+    assert out[2].endswith("\n2")
+
+def test_numbers_are_not_folded_in_body_text():
+    dedup = Deduplicator()
+    a = "Стоимость подписки на сервис для одного пользователя составляет 100 рублей в месяц без учёта налогов."
+    b = a.replace("100", "900")
+    kept = list(dedup.filter([FragmentCandidate(1, "1:0-1", a), FragmentCandidate(2, "2:0-1", b)]))
+    assert len(kept) == 2 and not dedup.dropped
+
+def test_exact_and_near_duplicates_are_dropped():
+    dedup = Deduplicator()
+    a = "Интеграция через API позволяет получать события из внешних систем и сохранять их в графе."
+    cands = [FragmentCandidate(1, "1:0-1", a), FragmentCandidate(2, "2:0-1", a.upper()),
+             FragmentCandidate(3, "3:0-1", a.replace("сохранять", "записывать"))]
+    kept = list(dedup.filter(cands))
+    assert [c.page for c in kept] == [1]
+    assert [d.reason for d in dedup.dropped] == ["exact", "near"]
@@ -0,0 +1,33 @@
+import pytest
+
+from boldsea_fragmentor.pagecache import PageCache
+from boldsea_fragmentor.reader import iter_any, pdf_extractor_id
+
+def test_failed_pages_are_not_cached(tmp_path):
+    cache = PageCache(str(tmp_path / "pages.sqlite"))
+    doc = "d"
+    pages = [(1, "first", True), (2, "", False), (3, "third", True)]
+    assert list(cache.cached_pages(doc, pages)) == [(1, "first"), (2, ""), (3, "third")]
+    assert cache.get_document(doc) is None
+    assert cache.stats()["pages"] == 2
+
+def test_unreadable_pdf_is_extracted_again(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf at all")
+    cache = PageCache(str(tmp_path / "pages.sqlite"))
+    assert list(iter_any(str(path), cache=cache)) == [(1, "")]
+    assert cache.get_document(cache.doc_key(str(path), variant=pdf_extractor_id())) is None
+    assert cache.stats()["pages"] == 0
+
+def test_key_includes_extractor_variant(tmp_path):
+    PyPDF2 = pytest.importorskip("PyPDF2")
+    path = tmp_path / "blank.pdf"
+    writer = PyPDF2.PdfWriter()
+    writer.add_blank_page(width=200, height=200)
+    writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    cache = PageCache(str(tmp_path / "pages.sqlite"))
+    assert list(iter_any(str(path), cache=cache)) == [(1, ""), (2, "")]
+    assert cache.get_document(cache.doc_key(str(path), variant=pdf_extractor_id())) == [(1, ""), (2, "")]
+    assert cache.get_document(cache.doc_key(str(path), variant="PyPDF2=0.0")) is None
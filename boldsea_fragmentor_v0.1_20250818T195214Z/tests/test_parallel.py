@@ -0,0 +1,20 @@
+import os
+
+from boldsea_fragmentor.parallel import ordered_pool_map
+
+def _square(x, parent):
+    return x * x
+
+def _crash_worker(x, parent):
+    # Kills the pool worker (BrokenProcessPool); harmless when redone in-process.
+    if x == 3 and os.getpid() != parent:
+        os._exit(1)
+    return x * x
+
+def test_results_in_order():
+    tasks = [(i, os.getpid()) for i in range(50)]
+    assert list(ordered_pool_map(_square, tasks, workers=2)) == [i * i for i in range(50)]
+
+def test_broken_pool_falls_back_in_process():
+    tasks = [(i, os.getpid()) for i in range(40)]
+    assert list(ordered_pool_map(_crash_worker, tasks, workers=2)) == [i * i for i in range(40)]
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк пост-обработки сегментатора (без LLM).
+
+    python3 bench_segmenter.py merge --sizes 1000,10000,100000,1000000
+    python3 bench_segmenter.py causals --sizes 1000,10000,100000
+    python3 bench_segmenter.py annotate --sizes 1000,10000,100000
+    python3 bench_segmenter.py windows input.md --window-chars 6000 --overlap-chars 600
+    python3 bench_segmenter.py route input.md --fragments out/<run>/fragments.jsonl --margins 0,2,4
+
+Генерирует синтетические фрагменты так, как их возвращают перекрывающиеся окна
+(соседние окна повторяют часть фрагментов с немного другими границами),
+замеряет merge_fragments / link_causals_by_spans / write_annotated_markdown и печатает JSON: секунды и нормированное время
+ns / (n·log2 n) — если оно почти не растёт с n, рост близок к O(n log n).
+С --check результат на малых n сверяется с прежней переборной реализацией.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import gc
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from boldsea_segmenter import (  # noqa: E402
+    BREAK_SENTENCE,
+    SCHEMA_LIBRARY,
+    Fragment,
+    SchemaRouter,
+    build_system_prompt,
+    estimate_tokens,
+    iou_1d,
+    link_causals_by_spans,
+    merge_fragments,
+    routing_false_negatives,
+    structured_window_iter,
+    text_breaks,
+    window_iter,
+    write_annotated_markdown,
+)
+
+SCHEMAS = ["Definition", "Causal Relation", "Example", "Algorithm", "Principle", "Use Case"]
+
+
+def synthetic_fragments(n: int, seed: int = 0, window_chars: int = 6000, overlap_chars: int = 600) -> List[Fragment]:
+    """n фрагментов по ~1 на 60 символов текста; ~10% из них — повторы из зоны перекрытия окон."""
+    rng = random.Random(seed)
+    frags: List[Fragment] = []
+    pos = 0
+    while len(frags) < n:
+        pos += rng.randint(10, 80)
+        length = rng.randint(40, 400)
+        schema = rng.choice(SCHEMAS)
+        start, end = pos, pos + length
+        window = start // (window_chars - overlap_chars)
+        frags.append(_fragment(len(frags), start, end, schema, rng.random(), window, rng))
+        if start % (window_chars - overlap_chars) < overlap_chars and len(frags) < n:
+            # то же место, увиденное соседним окном: границы сдвинуты на пару символов
+            d1, d2 = rng.randint(-5, 5), rng.randint(-5, 5)
+            frags.append(_fragment(len(frags), start + d1, end + d2, schema, rng.random(), window - 1, rng))
+    rng.shuffle(frags)
+    return frags
+
+
+def _fragment(i: int, start: int, end: int, schema: str, conf: float, window: int, rng: random.Random) -> Fragment:
+    return Fragment(
+        id=f"f_{i:08d}",
+        start_char=start,
+        end_char=end,
+        text="",
+        schema_id=schema,
+        schema_type="Fragment",
+        confidence=conf,
+        _chunk_index=window,
+        _source_window=(max(0, start - rng.randint(0, 3000)), end),
+        _local_causal_spans=[(rng.randint(0, 2000), rng.randint(2000, 3000))] if rng.random() < 0.3 else [],
+    )
+
+
+def merge_fragments_quadratic(frags: List[Fragment], iou_threshold: float = 0.66) -> List[Fragment]:
+    """Прежняя реализация merge_fragments (полный перебор kept) — эталон для --check."""
+    frags = sorted(frags, key=lambda x: (x.start_char, x.end_char))
+    kept: List[Fragment] = []
+    for f in frags:
+        merged = False
+        for k in kept:
+            if f.schema_id != k.schema_id:
+                continue
+            if iou_1d(f.start_char, f.end_char, k.start_char, k.end_char) >= iou_threshold:
+                if f.confidence > k.confidence:
+                    k.id = f.id
+                    k.start_char = f.start_char
+                    k.end_char = f.end_char
+                    k.text = f.text
+                    k.entity_refs = f.entity_refs or k.entity_refs
+                    k.actors = f.actors or k.actors
+                    k.acts = f.acts or k.acts
+                    k.confidence = f.confidence
+                    k.rationale = f.rationale or k.rationale
+                if f.id not in k.overlaps:
+                    k.overlaps.append(f.id)
+                if k.id not in f.overlaps:
+                    f.overlaps.append(k.id)
+                merged = True
+                break
+        if not merged:
+            kept.append(f)
+    id_map = {f.id: f for f in kept}
+    for f in kept:
+        f.overlaps = [oid for oid in f.overlaps if oid in id_map and oid != f.id]
+    return kept
+
+
+def link_causals_quadratic(frags: List[Fragment], min_iou: float = 0.2) -> None:
+    """Прежняя реализация link_causals_by_spans (каждый span против всех фрагментов) — эталон для --check."""
+    for f in frags:
+        abs_causals = []
+        base_offset = f._source_window[0]
+        for (s_rel, e_rel) in f._local_causal_spans:
+            if base_offset + s_rel < base_offset + e_rel:
+                abs_causals.append((base_offset + s_rel, base_offset + e_rel))
+        causals_ids = []
+        for (cs, ce) in abs_causals:
+            for g in frags:
+                if g is f:
+                    continue
+                if g.end_char <= f.start_char and iou_1d(cs, ce, g.start_char, g.end_char) > min_iou:
+                    causals_ids.append(g.id)
+        f.causals = sorted(set(causals_ids))
+
+
+def _clone(frags: List[Fragment]) -> List[Fragment]:
+    # merge_fragments меняет фрагменты на месте; копируем изменяемые поля
+    return [dataclasses.replace(f, overlaps=list(f.overlaps), causals=list(f.causals)) for f in frags]
+
+
+def _timed(fn: Callable[[], Any]) -> float:
+    # как timeit: без сборщика мусора, иначе на 10^6 объектов замер меряет в основном gc
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        fn()
+        return time.perf_counter() - t0
+    finally:
+        gc.enable()
+
+
+def bench_merge(sizes: List[int], seed: int = 0, check: bool = False) -> Dict[str, Any]:
+    rows = []
+    for n in sizes:
+        frags = synthetic_fragments(n, seed)
+        work = _clone(frags)
+        out: List[Fragment] = []
+        seconds = _timed(lambda: out.extend(merge_fragments(work)))
+        row: Dict[str, Any] = {
+            "n": n,
+            "kept": len(out),
+            "seconds": round(seconds, 4),
+            "ns_per_n_log_n": round(seconds * 1e9 / (n * math.log2(max(n, 2))), 2),
+        }
+        if check and n <= 10000:
+            ref_work = _clone(frags)
+            ref: List[Fragment] = []
+            row["quadratic_seconds"] = round(_timed(lambda: ref.extend(merge_fragments_quadratic(ref_work))), 4)
+            row["matches_quadratic"] = [f.__dict__ for f in ref] == [f.__dict__ for f in out]
+        rows.append(row)
+        print(json.dumps(row), file=sys.stderr)
+    return {"benchmark": "merge_fragments", "seed": seed, "rows": rows}
+
+
+def bench_causals(sizes: List[int], seed: int = 0, check: bool = False) -> Dict[str, Any]:
+    rows = []
+    for n in sizes:
+        frags = synthetic_fragments(n, seed)
+        work = _clone(frags)
+        seconds = _timed(lambda: link_causals_by_spans(work))
+        row: Dict[str, Any] = {
+            "n": n,
+            "links": sum(len(f.causals) for f in work),
+            "seconds": round(seconds, 4),
+            "ns_per_n_log_n": round(seconds * 1e9 / (n * math.log2(max(n, 2))), 2),
+        }
+        if check and n <= 10000:
+            ref = _clone(frags)
+            row["quadratic_seconds"] = round(_timed(lambda: link_causals_quadratic(ref)), 4)
+            row["matches_quadratic"] = [f.causals for f in ref] == [f.causals for f in work]
+        rows.append(row)
+        print(json.dumps(row), file=sys.stderr)
+    return {"benchmark": "link_causals_by_spans", "seed": seed, "rows": rows}
+
+
+def bench_annotate(sizes: List[int], seed: int = 0) -> Dict[str, Any]:
+    """Время и пик аллокаций Python при записи annotated.md; документ ~60 символов на фрагмент."""
+    rows = []
+    fd, path = tempfile.mkstemp(suffix=".md")
+    os.close(fd)
+    try:
+        for n in sizes:
+            frags = synthetic_fragments(n, seed)
+            length = max(f.end_char for f in frags)
+            text = ("Фрагмент текста для разметки. " * (length // 30 + 1))[:length]
+            frags = [f for f in frags if 0 <= f.start_char <= f.end_char <= length]
+            seconds = _timed(lambda: write_annotated_markdown(path, text, frags))
+            tracemalloc.start()
+            try:
+                write_annotated_markdown(path, text, frags)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            row = {
+                "n": len(frags),
+                "text_chars": length,
+                "seconds": round(seconds, 4),
+                "ns_per_n_log_n": round(seconds * 1e9 / (n * math.log2(max(n, 2))), 2),
+                "peak_alloc_bytes": peak,
+                "peak_alloc_per_marker": round(peak / (2 * max(len(frags), 1)), 1),
+            }
+            rows.append(row)
+            print(json.dumps(row), file=sys.stderr)
+    finally:
+        os.remove(path)
+    return {"benchmark": "write_annotated_markdown", "seed": seed, "rows": rows}
+
+
+def bench_windows(md_path: str, window_chars: int, overlap_chars: int,
+                  window_tokens: int, overlap_tokens: int) -> Dict[str, Any]:
+    """
+    Сравнивает нарезку chars и structure на реальном документе: число окон, оценку входных токенов
+    (сумма по окнам, т.е. с перехлёстом) и сколько разрезов пришлось не на границу предложения —
+    фрагменты на таких краях окно видит обрезанными.
+    """
+    with open(md_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    clean = {off for off, st in text_breaks(text) if st >= BREAK_SENTENCE}
+    modes = {
+        "chars": lambda: list(window_iter(text, window_chars, overlap_chars)),
+        "structure": lambda: list(structured_window_iter(text, window_tokens, overlap_tokens)),
+    }
+    res: Dict[str, Any] = {"document_tokens_est": estimate_tokens(text), "chars": len(text)}
+    for name, fn in modes.items():
+        windows: List[Any] = []
+        seconds = _timed(lambda: windows.extend(fn()))
+        cuts = [w[1] for w in windows[:-1]] + [w[0] for w in windows[1:]]
+        res[name] = {
+            "windows": len(windows),
+            "input_tokens_est": sum(estimate_tokens(w[2]) for w in windows),
+            "max_window_tokens_est": max((estimate_tokens(w[2]) for w in windows), default=0),
+            "mid_sentence_cuts": sum(1 for c in cuts if c not in clean),
+            "seconds": round(seconds, 4),
+        }
+    return {"benchmark": "windows", "input": os.path.abspath(md_path), **res}
+
+
+def bench_route(md_path: str, fragments_path: str, window_chars: int, overlap_chars: int,
+                margins: List[int], threshold: float = 2.0) -> Dict[str, Any]:
+    """
+    SchemaRouter на документе: сколько схем остаётся в промпте окна, экономия system-токенов и,
+    если дан fragments.jsonl прогона с полным промптом, доля пропусков. Фрагмент относится к каждому
+    окну, в которое целиком попадает; пропуск в одном окне считается, даже если соседнее окно
+    с перехлёстом его найдёт, — оценка сверху.
+    """
+    with open(md_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    active = list(SCHEMA_LIBRARY)
+    frags: List[Dict[str, Any]] = []
+    if fragments_path:
+        run_json = os.path.join(os.path.dirname(fragments_path), "run.json")
+        if os.path.exists(run_json):
+            with open(run_json, "r", encoding="utf-8") as f:
+                active = json.load(f).get("active_schemas", active)
+        with open(fragments_path, "r", encoding="utf-8") as f:
+            frags = [json.loads(line) for line in f if line.strip()]
+    windows = list(window_iter(text, window_chars, overlap_chars))
+    inside = [
+        [fr["schema_id"] for fr in frags if w[0] <= fr["start_char"] and fr["end_char"] <= w[1]]
+        for w in windows
+    ]
+    covered = sum(1 for fr in frags if any(w[0] <= fr["start_char"] and fr["end_char"] <= w[1] for w in windows))
+    full_tokens = estimate_tokens(build_system_prompt(active)) * len(windows)
+    res: Dict[str, Any] = {"windows": len(windows), "active_schemas": len(active), "system_tokens_full_est": full_tokens}
+    if frags:
+        res["fragments"] = len(frags)
+        res["fragments_spanning_windows"] = len(frags) - covered
+    rows = []
+    for margin in margins:
+        router = SchemaRouter(active, margin=margin, threshold=threshold, doc_text=text)
+        routed: List[List[str]] = []
+        seconds = _timed(lambda: routed.extend(router.route(w[2]) for w in windows))
+        tokens = sum(estimate_tokens(router.system_prompt(r)) for r in routed)
+        row: Dict[str, Any] = {
+            "margin": margin,
+            "threshold": threshold,
+            "schemas_avg": round(sum(map(len, routed)) / len(windows), 2) if windows else None,
+            "system_tokens_est": tokens,
+            "system_tokens_saved": round(1 - tokens / full_tokens, 4) if full_tokens else None,
+            "route_ms_per_window": round(seconds * 1000 / len(windows), 3) if windows else None,
+        }
+        if frags:
+            row["false_negatives"] = routing_false_negatives(zip(routed, inside))
+        rows.append(row)
+    return {"benchmark": "route", "input": os.path.abspath(md_path), **res, "rows": rows}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк пост-обработки Boldsea Segmenter")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_merge = sub.add_parser("merge", help="merge_fragments")
+    p_merge.add_argument("--sizes", default="1000,10000,100000,1000000")
+    p_merge.add_argument("--seed", type=int, default=0)
+    p_merge.add_argument("--check", action="store_true", help="Сверить с квадратичной реализацией (n <= 10000)")
+    p_causals = sub.add_parser("causals", help="link_causals_by_spans")
+    p_causals.add_argument("--sizes", default="1000,10000,100000,1000000")
+    p_causals.add_argument("--seed", type=int, default=0)
+    p_causals.add_argument("--check", action="store_true", help="Сверить с переборной реализацией (n <= 10000)")
+    p_annotate = sub.add_parser("annotate", help="write_annotated_markdown")
+    p_annotate.add_argument("--sizes", default="1000,10000,100000,1000000")
+    p_annotate.add_argument("--seed", type=int, default=0)
+    p_windows = sub.add_parser("windows", help="window_iter vs structured_window_iter на документе")
+    p_windows.add_argument("md")
+    p_windows.add_argument("--window-chars", type=int, default=6000)
+    p_windows.add_argument("--overlap-chars", type=int, default=600)
+    p_windows.add_argument("--window-tokens", type=int, default=2000)
+    p_windows.add_argument("--overlap-tokens", type=int, default=200)
+    p_route = sub.add_parser("route", help="SchemaRouter: размер промпта и пропуски против прогона с полным промптом")
+    p_route.add_argument("md")
+    p_route.add_argument("--fragments", default="", help="fragments.jsonl прогона без --schema-routing")
+    p_route.add_argument("--window-chars", type=int, default=6000)
+    p_route.add_argument("--overlap-chars", type=int, default=600)
+    p_route.add_argument("--margins", default="0,2,4")
+    p_route.add_argument("--threshold", type=float, default=2.0, help="Порог оценки схемы (--route-threshold)")
+    args = parser.parse_args()
+
+    if args.cmd == "route":
+        margins = [int(x) for x in args.margins.split(",") if x.strip()]
+        res = bench_route(args.md, args.fragments, args.window_chars, args.overlap_chars, margins, args.threshold)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        return 0
+    if args.cmd == "windows":
+        res = bench_windows(args.md, args.window_chars, args.overlap_chars, args.window_tokens, args.overlap_tokens)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        return 0
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    if args.cmd == "merge":
+        res = bench_merge(sizes, args.seed, args.check)
+    elif args.cmd == "causals":
+        res = bench_causals(sizes, args.seed, args.check)
+    else:
+        res = bench_annotate(sizes, args.seed)
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
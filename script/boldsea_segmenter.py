@@ -22,8 +22,12 @@ Boldsea Semantic Segmenter
 from __future__ import annotations
 
 import argparse
+import atexit
+import bisect
 import dataclasses
 from dataclasses import dataclass, field, asdict
+import glob
+import gzip
 import json
 import os
 import re
@@ -31,8 +35,13 @@ import sys
 import time
 import math
 import hashlib
+import io
 import logging
-from typing import Any, Dict, List, Optional, Tuple, Iterable
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple, Iterable, Iterator, Union
 
 # --------- Утилиты загрузки YAML/JSON-конфига ---------
 def load_config(path: str) -> Dict[str, Any]:
@@ -408,6 +417,170 @@ def window_iter(text: str, window_chars: int, overlap_chars: int) -> Iterable[Tu
         chunk_idx += 1
 
 
+# Сила границы: чем выше, тем чище разрез (и тем меньше нужен перехлёст)
+BREAK_HARD, BREAK_SENTENCE, BREAK_LINE, BREAK_PARAGRAPH, BREAK_HEADING = -1, 0, 1, 2, 3
+
+_FENCE_RE = re.compile(r"^[ \t]*(```|~~~)", re.M)
+_HEADING_RE = re.compile(r"^#{1,6}[ \t]", re.M)
+_BLANK_RUN_RE = re.compile(r"\n[ \t]*\n\s*")
+_HEADING_ONLY_RE = re.compile(r"[ \t]*#{1,6}[ \t][^\n]*\n\s*")
+_SENTENCE_END_RE = re.compile(r"[.!?…][\"'»”)\]]*[ \t]+(?=\S)")
+_ASCII_ALNUM_RE = re.compile(r"[A-Za-z0-9]")
+_WORD_CHAR_RE = re.compile(r"\w")
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора: ~4 символа на токен для латиницы/цифр,
+    ~2.5 для прочих букв (кириллица дробится мельче), пунктуация — полтокена.
+    """
+    ascii_chars = len(_ASCII_ALNUM_RE.findall(text))
+    word_chars = len(_WORD_CHAR_RE.findall(text))
+    punct = len(_PUNCT_RE.findall(text))
+    return math.ceil(ascii_chars / 4 + (word_chars - ascii_chars) / 2.5 + punct / 2)
+
+
+def text_breaks(text: str) -> List[Tuple[int, int]]:
+    """
+    Допустимые точки разреза (offset, сила), по возрастанию offset, включая 0 и len(text).
+    Внутри code fence и между строками таблицы разрезов нет (кроме самих границ блока).
+    """
+    n = len(text)
+    fences: List[Tuple[int, int]] = []
+    marks = [m.start() for m in _FENCE_RE.finditer(text)]
+    for i in range(0, len(marks), 2):
+        # незакрытый fence тянется до конца текста
+        fences.append((marks[i], text.find("\n", marks[i + 1]) + 1 or n if i + 1 < len(marks) else n))
+    fence_starts = [a for a, _ in fences]
+
+    def in_fence(pos: int) -> bool:
+        i = bisect.bisect_right(fence_starts, pos - 1) - 1
+        return i >= 0 and fences[i][0] < pos < fences[i][1]
+
+    def in_table(pos: int) -> bool:
+        # pos — начало строки; таблица, если эта и предыдущая строки начинаются с '|'
+        prev = text.rfind("\n", 0, pos - 1) + 1
+        return text.startswith("|", pos) and text.startswith("|", prev)
+
+    strength: Dict[int, int] = {0: BREAK_HEADING, n: BREAK_HEADING}
+    for m in _SENTENCE_END_RE.finditer(text):
+        strength.setdefault(m.end(), BREAK_SENTENCE)
+    pos = text.find("\n")
+    while pos != -1:
+        if pos + 1 < n:
+            strength[pos + 1] = max(strength.get(pos + 1, BREAK_LINE), BREAK_LINE)
+        pos = text.find("\n", pos + 1)
+    for m in _BLANK_RUN_RE.finditer(text):
+        strength[m.end()] = BREAK_PARAGRAPH
+    for m in _HEADING_RE.finditer(text):
+        strength[m.start()] = BREAK_HEADING
+    for a, b in fences:
+        strength[a] = max(strength.get(a, BREAK_LINE), BREAK_LINE)
+        if b < n:
+            strength[b] = max(strength.get(b, BREAK_LINE), BREAK_LINE)
+
+    out: List[Tuple[int, int]] = []
+    block_start = 0  # начало текущего блока (после последней границы абзаца/заголовка)
+    for off in sorted(strength):
+        st = strength[off]
+        if 0 < off < n:
+            if in_fence(off):
+                continue
+            if st == BREAK_LINE and in_table(off):
+                continue
+            if st == BREAK_SENTENCE and text.startswith("|", text.rfind("\n", 0, off) + 1):
+                continue
+            if st >= BREAK_PARAGRAPH and _HEADING_ONLY_RE.fullmatch(text, block_start, off):
+                # заголовок не отрываем от его содержимого
+                st = BREAK_LINE
+        if st >= BREAK_PARAGRAPH:
+            block_start = off
+        out.append((off, st))
+    return out
+
+
+def structured_window_iter(text: str, window_tokens: int, overlap_tokens: int) -> Iterable[Tuple[int, int, str, int]]:
+    """
+    Окна по оценке токенов с разрезами по заголовкам/абзацам/строкам/предложениям.
+    Возвращает ту же последовательность (start_offset, end_offset, chunk_text, chunk_index), что window_iter.
+
+    Конец окна — самая сильная граница во второй половине бюджета (при равенстве — самая поздняя).
+    Перехлёст зависит от чистоты разреза: по заголовку его нет, по абзацу — не больше половины
+    overlap_tokens, иначе — до overlap_tokens; начало следующего окна тоже ставится на границу.
+    Блок без границ длиннее бюджета (огромный code fence, строка без пробелов) режется по символам.
+    """
+    if window_tokens <= 0:
+        raise ValueError("window_tokens must be > 0")
+    if overlap_tokens < 0 or overlap_tokens >= window_tokens:
+        raise ValueError("0 <= overlap_tokens < window_tokens")
+    n = len(text)
+    if n == 0:
+        return
+    breaks = text_breaks(text)
+    offsets = [b for b, _ in breaks]
+    # cum[i] — оценка токенов в text[:offsets[i]]
+    cum = [0]
+    for i in range(1, len(breaks)):
+        cum.append(cum[-1] + estimate_tokens(text[offsets[i - 1]:offsets[i]]))
+
+    def tokens_at(pos: int) -> float:
+        # линейная интерполяция внутри куска между соседними границами
+        i = bisect.bisect_right(offsets, pos) - 1
+        if offsets[i] == pos or i + 1 >= len(offsets):
+            return cum[i]
+        return cum[i] + (cum[i + 1] - cum[i]) * (pos - offsets[i]) / (offsets[i + 1] - offsets[i])
+
+    def pos_for_tokens(target: float, lo: int) -> int:
+        # наибольшая позиция > lo, до которой набирается не больше target токенов
+        i = bisect.bisect_right(cum, target) - 1
+        if i + 1 >= len(offsets):
+            return n
+        span = cum[i + 1] - cum[i]
+        frac = (target - cum[i]) / span if span else 1.0
+        return max(lo + 1, min(offsets[i + 1], offsets[i] + int((offsets[i + 1] - offsets[i]) * frac)))
+
+    start = 0
+    chunk_idx = 0
+    while start < n:
+        base = tokens_at(start)
+        if cum[-1] - base <= window_tokens:
+            yield (start, n, text[start:n], chunk_idx)
+            break
+        limit = pos_for_tokens(base + window_tokens, start)
+        lo = bisect.bisect_right(offsets, start)
+        hi = bisect.bisect_right(offsets, limit)
+        end, end_strength = limit, BREAK_HARD
+        half = base + window_tokens / 2
+        for i in range(lo, hi):
+            st = breaks[i][1]
+            if cum[i] >= half and st >= end_strength:
+                end, end_strength = offsets[i], st
+        if end_strength == BREAK_HARD and hi > lo:
+            # в хвосте бюджета границ нет — берём последнюю из имеющихся
+            end, end_strength = offsets[hi - 1], breaks[hi - 1][1]
+        yield (start, end, text[start:end], chunk_idx)
+        chunk_idx += 1
+
+        if end_strength == BREAK_HEADING:
+            allowance = 0.0
+        elif end_strength == BREAK_PARAGRAPH:
+            allowance = overlap_tokens / 2
+        else:
+            allowance = float(overlap_tokens)
+        nxt = end
+        if allowance:
+            back = tokens_at(end) - allowance
+            i = bisect.bisect_left(offsets, start + 1)
+            j = bisect.bisect_left(offsets, end)
+            k = bisect.bisect_left(cum, back, i, j)
+            if k < j:
+                nxt = offsets[k]
+            elif end_strength == BREAK_HARD:
+                nxt = max(start + 1, pos_for_tokens(back, start))
+        start = max(nxt, start + 1)
+
+
 # --------- Сборка промптов ---------
 ONT_BRIEF = (
     "Ты выполняешь СЕМАНТИЧЕСКОЕ разбиение текста на фрагменты согласно онтологии Boldsea.\n"
@@ -458,26 +631,795 @@ def build_user_prompt(chunk_text: str, offset: int) -> str:
     )
 
 
+# --------- Маршрутизация схем по окнам ---------
+@dataclass(frozen=True)
+class SchemaCue:
+    """
+    Признаки схемы для SchemaRouter. strong — явные маркеры (оборот, структура), одного совпадения
+    хватает; weak — тематическая лексика, засчитывается по плотности на 1000 символов окна.
+    Служебные слова («это», «через», «может», «than», «can») в признаки не входят: они есть почти в любом окне.
+    """
+
+    strong: Optional["re.Pattern[str]"] = None
+    weak: Optional["re.Pattern[str]"] = None
+
+
+def _cue(strong: str = "", weak: str = "", flags: int = re.I) -> SchemaCue:
+    return SchemaCue(re.compile(strong, flags) if strong else None, re.compile(weak, flags) if weak else None)
+
+
+SCHEMA_CUES: Dict[str, SchemaCue] = {
+    "Definition": _cue(
+        r"\s[—–-]\s+это\b|\bопределяется как\b|\bопределени[ея]\b|\bназыва(ет|ют)ся\b|\bпредставля(ет|ют) собой\b"
+        r"|\bпонима(ет|ют)ся\b|\bозначает\b|\brefers? to\b|\bis defined as\b|\bdefinition\b",
+        r"\bтермин|\bis an?\b|\bmeans\b|\bdenotes\b"),
+    "Comparison": _cue(
+        r"\bв отличие от\b|\bпо сравнению с\b|\bсравн|\bотлича(ет|ют)ся\b|\bvs\.?(?=\s)|\bversus\b|\bcompar|\bunlike\b"
+        r"|\bin contrast\b",
+        r"\bлучше\b|\bхуже\b|\bбыстрее\b|\bмедленнее\b|\bдешевле\b|\bдороже\b|\bbetter\b|\bworse\b|\bfaster\b|\bslower\b"),
+    "Causal Relation": _cue(
+        r"\bприв(одит|одят|ёл|ел|ела|ели|ести) к\b|\bв результате\b|\bвследствие\b|\bобусловлен|\bиз-за\b"
+        r"|\bdue to\b|\bresults? in\b|\bleads? to\b|\bcaused by\b",
+        r"\bпотому что\b|\bпоэтому\b|\bтак как\b|\bблагодаря\b|\bследовательно\b|\bвызыва(ет|ют)\b|\bbecause\b"
+        r"|\btherefore\b|\bhence\b"),
+    "Application Context": _cue(
+        r"\bприменя(ет|ют)ся\b|\bиспольз(уется|уются) (в|для|при)\b|\b(област|сфер)[ьиа] применени|\bused (in|for)\b"
+        r"|\bapplied (to|in)\b|\bapplication context\b",
+        r"\bприменени|\bотрасл|\bсфер[аеуы]\b|\bapplication|\bindustr|\bdomain"),
+    "Example": _cue(
+        r"\bнапример\b|\bк примеру\b|\bв частности\b|\bпример(ом)?\s*:|\be\.g\.|\bfor (example|instance)\b|\bsuch as\b",
+        r"\bпример|\bexample"),
+    "Architectural Component": _cue(
+        r"\bкомпонент|\bмодул[ьяиейю]|\bподсистем|\bархитектур|\bcomponent|\bmodules?\b|\barchitect|\bsubsystem",
+        r"\bдвиж(ок|ка|ке)\b|\bконтроллер|\bсервис|\bслой|\bслои\b|\bхранилищ|\bengine\b|\bservice|\blayer|\bstorage"),
+    "Technical Process": _cue(
+        r"\bконвейер|\bpipeline|\bвходн(ые|ых) данн|\bвыходн(ые|ых) данн|\bэтап(ы|ов)? обработки|\bworkflow",
+        r"\bпроцесс|\bэтап|\bстади|\bобработ|\bprocess|\bstage"),
+    "Algorithm": _cue(
+        r"\bалгоритм|\balgorithm|\bпсевдокод|\bpseudocode|\bO\([^)\n]{1,20}\)|^[ \t]*(шаг|step) \d",
+        r"\bметод|\bшаг|\bитерац|\bвычисл|\bсортир|\bprocedure|\bsteps?\b|\biterat|\bcomput",
+        re.I | re.M),
+    "Conceptual Model": _cue(
+        r"\bконцептуальн|\bонтолог|\bметамодел|\bconceptual model|\bontolog|\bmetamodel",
+        r"\bмодел|\bконцеп|\bабстракц|\bпарадигм|\bсущност|\bmodel|\bconcept|\bentit|\babstraction"),
+    "Principle": _cue(
+        r"\bпринцип|\bprincipl|\bаксиом|\baxiom",
+        r"\bподход|\bправил|\bзакон|\brules?\b|\bapproach"),
+    "Problem Solution": _cue(
+        r"\bпроблем|\bproblem|\bsolution",
+        r"\bрешени|\bреша|\bзадач|\bустран|\bsolv|\bissue"),
+    "Limitations And Challenges": _cue(
+        r"\bограничени|\bнедостат(ок|ка|ки|ков)\b|\bузк(ое|ие) мест|\blimitation|\bchalleng|\bbottleneck",
+        r"\bвызов|\bсложност|\bтрудност|\bриск|\blimit|\brisk|\bcomplexit"),
+    "Functionality": _cue(
+        r"\bфункциональност|\bфункци[яиюей]\b|\bfunctionality|\bfeatures?\b",
+        r"\bпозволя(ет|ют)\b|\bобеспечива|\bподдержива|\bвыполня|\ballows?\b|\bsupports?\b|\benables?\b"),
+    "Capabilities": _cue(
+        r"\bвозможност|\bспособн|\bуме(ет|ют)\b|\bcapabilit",
+        r"\bпозволя(ет|ют)\b|\ballows?\b|\benables?\b"),
+    "System Integration": _cue(
+        r"\bинтеграц|\bсовместим|\bконнектор|\bAPI\b|\bSDK\b|\bREST\b|\bwebhook|\bintegrat|\bconnector",
+        r"\bпротокол|\bинтерфейс|\bподключ|\bимпорт|\bэкспорт|\bJSON\b|\binterface|\bprotocol|\bimport|\bexport"),
+    "Component Interaction": _cue(
+        r"\bвзаимодейств|\bобмен(а|ом|ива)?|\binteract|\bочеред[ьи] сообщени|\bmessage (bus|queue|broker)",
+        r"\bпереда(ёт|ет|ют|ча)|\bсообщени|\bсобыти|\bзапрос|\bmessag|\bevent|\brequest"),
+    "Use Case": _cue(
+        r"\bсценари|\bактор|\buse cases?\b|\bscenario|\bactor|\buser stor",
+        r"\bпользовател|\bклиент|\bкейс|\busers?\b|\bcustomer"),
+    "Concept Implementation": _cue(
+        r"\bреализаци|\bфреймворк|\bimplementation|\bframework",
+        r"\bреализ|\bтехнолог|\bбиблиотек|\bстек\b|\bimplement|\blibrar|\btechnolog"),
+    "Code Snippet": _cue(
+        r"```|~~~|=>|^[ \t]*(def|class|import|return|function|const|let|var|public|private)\b"
+        r"|^(?: {4}|\t)\S.*[;{}]\s*$",
+        flags=re.M),
+    "Enumeration": _cue(r"^[ \t]*(?:[-*+•]|\d+[.)])[ \t]+\S", flags=re.M),
+    "Table Analysis": _cue(r"^[ \t]*\|.*\|[ \t]*$", r"\bтаблиц|\btable\b", re.I | re.M),
+    "Advantage Disadvantage": _cue(
+        r"\bпреимуществ|\bнедостатк(и|ов)\b|\bплюсы\b|\bминусы\b|\bдостоинств|\badvantage|\bdisadvantage|\bpros\b"
+        r"|\bcons\b",
+        r"\bвыгод|\bbenefit|\bdrawback|\bплюс\b|\bминус\b"),
+}
+
+
+class SchemaRouter:
+    """
+    Дешёвый локальный пре-роутер: для окна оставляет только правдоподобные схемы.
+
+    Оценка схемы (scores) — strong_weight за каждое явное совпадение плюс плотность тематических
+    совпадений на 1000 символов (окно короче 1000 считается за 1000). Схема проходит, если оценка
+    не ниже threshold; схемы без признаков (нет в SCHEMA_CUES) проходят всегда. Запас прочности —
+    ещё margin непрошедших схем, самых сильных по оценке во всём документе. Порядок схем — как в
+    active_schemas, так что одинаковые наборы дают один и тот же промпт (и попадания в кэш).
+    """
+
+    def __init__(
+        self,
+        active_schemas: List[str],
+        margin: int = 2,
+        threshold: float = 2.0,
+        doc_text: str = "",
+        strong_weight: float = 2.0,
+    ):
+        self.active_schemas = list(active_schemas)
+        self.margin = margin
+        self.threshold = threshold
+        self.strong_weight = strong_weight
+        prior = self.scores(doc_text)
+        # для запаса: по оценке в документе, при равенстве — по порядку active_schemas
+        self._by_prior = sorted(self.active_schemas, key=lambda sid: -prior.get(sid, 0.0))
+        self._prompts: Dict[Tuple[str, ...], str] = {}
+
+    def scores(self, chunk: str) -> Dict[str, float]:
+        per_k = 1000.0 / max(len(chunk), 1000)
+        out: Dict[str, float] = {}
+        for sid in self.active_schemas:
+            cue = SCHEMA_CUES.get(sid)
+            if cue is None:
+                continue
+            strong = len(cue.strong.findall(chunk)) if cue.strong else 0
+            weak = len(cue.weak.findall(chunk)) if cue.weak else 0
+            out[sid] = self.strong_weight * strong + weak * per_k
+        return out
+
+    def route(self, chunk: str) -> List[str]:
+        scores = self.scores(chunk)
+        chosen = {sid for sid in self.active_schemas if scores.get(sid, self.threshold) >= self.threshold}
+        extra = [sid for sid in self._by_prior if sid not in chosen][: self.margin]
+        chosen.update(extra)
+        return [sid for sid in self.active_schemas if sid in chosen]
+
+    def system_prompt(self, schemas: List[str]) -> str:
+        key = tuple(schemas)
+        if key not in self._prompts:
+            self._prompts[key] = build_system_prompt(schemas)
+        return self._prompts[key]
+
+
+def routing_false_negatives(samples: Iterable[Tuple[List[str], List[str]]]) -> Dict[str, Any]:
+    """
+    Доля пропусков маршрутизатора. samples — пары (схемы, отданные окну; schema_id фрагментов,
+    найденных в этом окне с полным промптом). Пропуск — фрагмент схемы, которой не было в промпте окна.
+    """
+    windows = windows_missed = fragments = missed = 0
+    by_schema: Dict[str, int] = {}
+    for routed, found in samples:
+        windows += 1
+        routed_set = set(routed)
+        miss = [sid for sid in found if sid not in routed_set]
+        fragments += len(found)
+        missed += len(miss)
+        windows_missed += bool(miss)
+        for sid in miss:
+            by_schema[sid] = by_schema.get(sid, 0) + 1
+    return {
+        "windows": windows,
+        "windows_with_miss": windows_missed,
+        "fragments": fragments,
+        "missed": missed,
+        "fn_rate": round(missed / fragments, 4) if fragments else None,
+        "missed_by_schema": dict(sorted(by_schema.items(), key=lambda x: -x[1])),
+    }
+
+
+# --------- Журнал вызовов LLM ---------
+class CallLogWriter:
+    """
+    Буферизованный журнал вызовов LLM (llm_calls.jsonl или llm_calls.jsonl.gz).
+
+    write() только кладёт запись в буфер; сериализация и запись на диск идут в фоновом потоке
+    раз в flush_interval секунд (или раньше, когда в буфере max_buffered записей), а также при close()
+    и при выходе из процесса. Каждый отличающийся system-промпт пишется в файл один раз записью
+    {"type": "system", "hash": ..., "text": ...}, а вызовы ссылаются на него полем system_hash.
+    Когда файл превышает max_bytes, он переименовывается в llm_calls.<N>.jsonl[.gz]
+    и запись продолжается в новый файл (каждый файл самодостаточен).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_interval: float = 2.0,
+        max_buffered: int = 256,
+    ):
+        self.path = path
+        self.gzip = path.endswith(".gz")
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.records_written = 0
+        self._buffer: List[Tuple[Dict[str, Any], str]] = []
+        self._systems_written: set = set()  # хеши system-промптов в текущем файле
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # дописываем в существующий файл: его system-записи уже есть
+            self._systems_written = {h for h, _ in _iter_system_records(path)}
+        self._thread = threading.Thread(target=self._run, name="llm-call-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, rec: Dict[str, Any], system_prompt: str) -> None:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CallLogWriter is closed")
+            self._buffer.append((rec, system_prompt))
+            if len(self._buffer) >= self.max_buffered:
+                self._wake.set()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARN] llm call log flush failed: {e}", file=sys.stderr)
+
+    def flush(self) -> None:
+        with self._io_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            lines: List[str] = []
+            for rec, system_prompt in batch:
+                h = content_hash(system_prompt)
+                if h not in self._systems_written:
+                    self._systems_written.add(h)
+                    lines.append(json.dumps({"type": "system", "hash": h, "text": system_prompt}, ensure_ascii=False))
+                lines.append(json.dumps(dict(rec, system_hash=h), ensure_ascii=False))
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            if self.gzip:
+                # каждый flush — отдельный gzip-член; склейка членов — валидный gzip
+                data = gzip.compress(data)
+            with open(self.path, "ab") as f:
+                f.write(data)
+            self.records_written += len(batch)
+            if os.path.getsize(self.path) > self.max_bytes:
+                self._rotate()
+
+    def _rotate(self) -> None:
+        base, ext = _split_log_ext(self.path)
+        n = 1
+        while os.path.exists(f"{base}.{n}{ext}"):
+            n += 1
+        os.replace(self.path, f"{base}.{n}{ext}")
+        self._systems_written = set()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass
+
+
+def _split_log_ext(path: str) -> Tuple[str, str]:
+    """llm_calls.jsonl.gz -> ("llm_calls", ".jsonl.gz")"""
+    for ext in (".jsonl.gz", ".jsonl"):
+        if path.endswith(ext):
+            return path[: -len(ext)], ext
+    return os.path.splitext(path)
+
+
+def call_log_files(run_dir: str) -> List[str]:
+    """Все файлы журнала вызовов в каталоге запуска, от старых ротаций к текущему."""
+    files = glob.glob(os.path.join(run_dir, "llm_calls*.jsonl")) + glob.glob(os.path.join(run_dir, "llm_calls*.jsonl.gz"))
+
+    def order(path: str) -> Tuple[int, int]:
+        suffix = _split_log_ext(os.path.basename(path))[0][len("llm_calls"):]
+        return (0, int(suffix[1:])) if suffix[1:].isdigit() else (1, 0)
+
+    return sorted(files, key=order)
+
+
+def _open_log(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _iter_system_records(path: str) -> Iterator[Tuple[str, str]]:
+    for rec in _iter_raw_log(path):
+        if rec.get("type") == "system":
+            yield rec["hash"], rec["text"]
+
+
+def _iter_raw_log(path: str) -> Iterator[Dict[str, Any]]:
+    try:
+        with _open_log(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except Exception:
+                    continue
+    except (EOFError, OSError):
+        # оборванный хвост gzip после падения процесса
+        return
+
+
+def iter_call_log(path: str, with_prompts: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Записи вызовов из журнала (plain или gzip; старый формат с system в каждой записи тоже читается).
+    С with_prompts поле system восстанавливается по system_hash.
+    """
+    systems: Dict[str, str] = {}
+    for rec in _iter_raw_log(path):
+        if rec.get("type") == "system":
+            systems[rec["hash"]] = rec["text"]
+            continue
+        if with_prompts:
+            if "system" not in rec and rec.get("system_hash") in systems:
+                rec["system"] = systems[rec["system_hash"]]
+        else:
+            for k in ("system", "user", "response"):
+                rec.pop(k, None)
+        yield rec
+
+
+# --------- Кэш ответов LLM ---------
+def request_key(model: str, temperature: float, max_tokens: int, system_prompt: str, user_prompt: str) -> str:
+    """Хеш полного запроса к LLM — ключ кэша ответов."""
+    return content_hash(json.dumps([model, temperature, max_tokens, system_prompt, user_prompt], ensure_ascii=False))
+
+
+class ResponseCache:
+    """
+    Персистентный кэш ответов LLM (SQLite), адресуемый хешем запроса.
+    Вытеснение: записи старше max_age_sec удаляются, при превышении max_bytes
+    удаляются давно не использованные (LRU).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, max_age_sec: Optional[float] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.hits = 0
+        self.misses = 0
+        self.seeded = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, atime REAL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_sec is not None and now - row[1] > self.max_age_sec:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET atime = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, created: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), created or now, now),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self) -> int:
+        removed = 0
+        with self._lock, self._db:
+            if self.max_age_sec is not None:
+                cur = self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_sec,))
+                removed += cur.rowcount
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                doomed = []
+                for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY atime"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                removed += len(doomed)
+        return removed
+
+    def seed_from_logs(self, pattern: str) -> int:
+        """
+        Наполняет кэш из существующих журналов llm_calls.jsonl[.gz] (glob-шаблон).
+        Берутся записи с request_key, а у старых логов — те, где user-промпт
+        не был усечён при логировании (иначе ключ восстановить нельзя).
+        Только завершённые ответы: finish_reason "stop"/"completed" (см. _is_complete);
+        у записей без finish_reason (логи до телеметрии) — только с закрытым JSON.
+        Иначе обрезанный ответ стал бы попаданием в кэш и считался бы полным.
+        """
+        added = 0
+        for path in sorted(glob.glob(pattern)):
+            for rec in iter_call_log(path):
+                try:
+                    key = rec.get("request_key")
+                    if not key:
+                        user = rec["user"]
+                        if len(user) >= 5000:
+                            continue
+                        key = request_key(rec["model"], rec["temperature"], rec["max_tokens"], rec["system"], user)
+                    response = rec["response"]
+                except Exception:
+                    continue
+                if rec.get("status", "ok") not in ("ok", "completed"):
+                    continue
+                if "finish_reason" in rec:
+                    if not _is_complete(rec["finish_reason"]):
+                        continue
+                elif json_tail_open(response):
+                    continue
+                if len(response) >= 100000:
+                    continue  # ответ был усечён при логировании
+                with self._lock:
+                    exists = self._db.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+                if exists:
+                    continue
+                self.put(key, response, created=rec.get("ts"))
+                added += 1
+        self.seeded += added
+        return added
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"path": os.path.abspath(self.path), "hits": self.hits, "misses": self.misses,
+                "seeded": self.seeded, "entries": entries, "bytes": size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# --------- Телеметрия LLM ---------
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def response_usage(resp: Any) -> Dict[str, Any]:
+    """
+    Токены и причина завершения из ответа Responses API (или Chat Completions).
+    Отсутствующие поля — None.
+    """
+    usage = _field(resp, "usage")
+    input_tokens = _field(usage, "input_tokens")
+    if input_tokens is None:
+        input_tokens = _field(usage, "prompt_tokens")
+    output_tokens = _field(usage, "output_tokens")
+    if output_tokens is None:
+        output_tokens = _field(usage, "completion_tokens")
+    in_details = _field(usage, "input_tokens_details") or _field(usage, "prompt_tokens_details")
+    out_details = _field(usage, "output_tokens_details") or _field(usage, "completion_tokens_details")
+
+    status = _field(resp, "status")
+    finish_reason = _field(_field(resp, "incomplete_details"), "reason")
+    if finish_reason is None:
+        choices = _field(resp, "choices")
+        if choices:
+            finish_reason = _field(choices[0], "finish_reason")
+    if finish_reason is None and status is not None:
+        finish_reason = "stop" if status == "completed" else status
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": _field(in_details, "cached_tokens"),
+        "reasoning_tokens": _field(out_details, "reasoning_tokens"),
+        "finish_reason": finish_reason,
+    }
+
+
+def _percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    """Процентиль с линейной интерполяцией (как numpy по умолчанию)."""
+    if not sorted_vals:
+        return None
+    pos = (len(sorted_vals) - 1) * q
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+def _is_truncated(finish_reason: Optional[str]) -> bool:
+    return finish_reason in ("max_output_tokens", "length")
+
+
+def _is_complete(finish_reason: Optional[str]) -> bool:
+    """Ответ дошёл целиком (в кэш кладутся и из логов берутся только такие)."""
+    return finish_reason in ("stop", "completed")
+
+
+def summarize_calls(calls: List[Dict[str, Any]], wall_sec: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Агрегат по записям вызовов (из LLMClient.calls или llm_calls.jsonl):
+    суммы токенов, перцентили задержки, частота упора в max_output_tokens, формы запросов.
+    """
+    api = [c for c in calls if not c.get("cached")]
+    latencies = sorted(float(c["latency_sec"]) for c in api if c.get("latency_sec") is not None)
+
+    def total(name: str) -> Optional[int]:
+        vals = [c[name] for c in api if c.get(name) is not None]
+        return sum(vals) if vals else None
+
+    input_tokens = total("input_tokens")
+    output_tokens = total("output_tokens")
+    finish: Dict[str, int] = {}
+    shapes: Dict[str, int] = {}
+    for c in api:
+        fr = c.get("finish_reason")
+        if fr is not None:
+            finish[fr] = finish.get(fr, 0) + 1
+        if c.get("shape"):
+            shapes[c["shape"]] = shapes.get(c["shape"], 0) + 1
+    truncated = sum(n for fr, n in finish.items() if _is_truncated(fr))
+    out: Dict[str, Any] = {
+        "calls": len(calls),
+        "api_calls": len(api),
+        "cache_hits": len(calls) - len(api),
+        "retries": sum(int(c.get("retries") or 0) for c in api),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": total("cached_tokens"),
+        "reasoning_tokens": total("reasoning_tokens"),
+        "input_tokens_per_call": round(input_tokens / len(api), 1) if input_tokens is not None and api else None,
+        "output_tokens_per_call": round(output_tokens / len(api), 1) if output_tokens is not None and api else None,
+        "latency_sec": {
+            "total": round(sum(latencies), 3),
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": _round(_percentile(latencies, 0.50)),
+            "p95": _round(_percentile(latencies, 0.95)),
+            "p99": _round(_percentile(latencies, 0.99)),
+            "max": _round(latencies[-1] if latencies else None),
+        },
+        "finish_reasons": finish,
+        "max_output_tokens_hits": truncated,
+        "max_output_tokens_hit_rate": round(truncated / len(api), 4) if api else None,
+        "request_shapes": shapes,
+    }
+    # потоковый режим: время до первого токена и до первого закрытого фрагмента
+    for name in ("ttft_sec", "ttff_sec"):
+        vals = sorted(float(c[name]) for c in api if c.get(name) is not None)
+        if vals:
+            out[name] = {"p50": _round(_percentile(vals, 0.50)), "p95": _round(_percentile(vals, 0.95))}
+    if wall_sec:
+        out["wall_sec"] = round(wall_sec, 3)
+        out["calls_per_sec"] = round(len(api) / wall_sec, 3)
+        if output_tokens is not None:
+            out["output_tokens_per_sec"] = round(output_tokens / wall_sec, 1)
+    return out
+
+
+def _round(x: Optional[float]) -> Optional[float]:
+    return round(x, 3) if x is not None else None
+
+
+# --------- Формы запроса к Responses API ---------
+def _error_status(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    Временная ошибка (повторить тот же запрос позже), а не несовместимость формы запроса:
+    429/408/409/5xx, таймауты и обрывы соединения (в т.ч. openai.APIConnectionError/APITimeoutError).
+    """
+    status = _error_status(exc)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    name = type(exc).__name__
+    return any(part in name for part in ("Timeout", "Connection", "RateLimit", "InternalServer", "ServiceUnavailable"))
+
+
+class RequestShapeMemo:
+    """
+    Запомненная рабочая форма запроса по модели. Живёт в процессе (общая для всех LLMClient)
+    и, если задан path, сохраняется в JSON-файл между запусками.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, str] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._shapes = dict(json.load(f))
+            except Exception as e:
+                print(f"[WARN] Не удалось прочитать {path}: {e}", file=sys.stderr)
+
+    def get(self, model: str) -> Optional[str]:
+        with self._lock:
+            return self._shapes.get(model)
+
+    def set(self, model: str, shape: str) -> None:
+        with self._lock:
+            self._shapes[model] = shape
+            if self.path:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._shapes, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.path)
+
+
+# по умолчанию — общий на процесс, только в памяти
+SHAPE_MEMO = RequestShapeMemo()
+
+
+# --------- Лимиты RPM/TPM ---------
+class RateLimiter:
+    """
+    Общий лимит запросов и токенов в минуту (token bucket) для всех потоков и документов.
+    Ёмкость ведра — минутный бюджет, пополнение равномерное. acquire(tokens) блокирует,
+    пока в обоих ведрах не хватит на запрос; запрос дороже всего бюджета токенов ждёт полного ведра
+    и уводит его в минус (иначе он не прошёл бы никогда). None/0 — без ограничения по этой оси.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self._requests = float(self.rpm or 0)
+        self._tokens = float(self.tpm or 0)
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens = 0
+        self.waited_sec = 0.0
+
+    def _wait_needed(self, tokens: int) -> float:
+        now = time.monotonic()
+        dt, self._t = now - self._t, now
+        wait = 0.0
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + dt * self.rpm / 60)
+            if self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.rpm
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + dt * self.tpm / 60)
+            need = min(tokens, self.tpm)
+            if self._tokens < need:
+                wait = max(wait, (need - self._tokens) * 60 / self.tpm)
+        return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Забирает бюджет на один запрос; возвращает, сколько секунд пришлось ждать."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                wait = self._wait_needed(tokens)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    waited = time.monotonic() - started
+                    self.requests += 1
+                    self.tokens += tokens
+                    self.waited_sec += waited
+                    return waited
+            time.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests": self.requests,
+                "tokens_est": self.tokens,
+                "waited_sec": round(self.waited_sec, 3),
+            }
+
+
 # --------- LLM-клиент (OpenAI) ---------
 class LLMClient:
-    def __init__(self, model: str, temperature: float, max_tokens: int, log_path: Optional[str] = None):
+    def __init__(
+        self,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        log_path: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        log_writer: Optional[CallLogWriter] = None,
+        shape_memo: Optional[RequestShapeMemo] = None,
+        transient_retries: int = 2,
+        backoff_sec: float = 1.0,
+        rate_limiter: Optional[RateLimiter] = None,
+        stream: bool = False,
+    ):
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.log_path = log_path
+        if log_writer is None and log_path:
+            log_writer = CallLogWriter(log_path)
+        self.log_writer = log_writer
+        self.shape_memo = shape_memo or SHAPE_MEMO
+        self.transient_retries = transient_retries
+        self.backoff_sec = backoff_sec
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.stream = stream
 
         # Ленивая инициализация openai
         self._openai = None
+        # chat() может вызываться из нескольких потоков (см. dispatch_windows)
+        self._init_lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        # телеметрия по вызовам chat() за время жизни клиента (см. telemetry())
+        self.calls: List[Dict[str, Any]] = []
 
     def _ensure_openai(self):
-        if self._openai is None:
-            try:
-                from openai import OpenAI  # type: ignore
-            except Exception as e:
-                raise RuntimeError("Нужен пакет openai>=1.0.0 для LLM-режима. Установите: pip install openai") from e
-            self._openai = OpenAI()
+        with self._init_lock:
+            if self._openai is None:
+                try:
+                    from openai import OpenAI  # type: ignore
+                except Exception as e:
+                    raise RuntimeError("Нужен пакет openai>=1.0.0 для LLM-режима. Установите: pip install openai") from e
+                self._openai = OpenAI()
+
+    def request_key(self, system_prompt: str, user_prompt: str) -> str:
+        return request_key(self.model, self.temperature, self.max_tokens, system_prompt, user_prompt)
+
+    def forget(self, system_prompt: str, user_prompt: str) -> None:
+        """Убирает ответ из кэша (например, если он не распарсился)."""
+        if self.cache is not None:
+            self.cache.delete(self.request_key(system_prompt, user_prompt))
 
     def chat(self, system_prompt: str, user_prompt: str) -> str:
+        return self.chat_result(system_prompt, user_prompt)[0]
+
+    def chat_result(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        on_fragment: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        Как chat(), но вместе с finish_reason ответа (None для ответа из кэша).
+        on_fragment получает каждый закрывшийся объект массива fragments (FragmentStreamParser):
+        при stream=True — по мере прихода ответа, иначе — сразу после него.
+        """
+        key = self.request_key(system_prompt, user_prompt)
+        if self.cache is not None:
+            t0 = time.time()
+            cached = self.cache.get(key)
+            if cached is not None:
+                with self._log_lock:
+                    self.calls.append({"ts": time.time(), "latency_sec": time.time() - t0, "cached": True})
+                if on_fragment is not None:
+                    for obj in FragmentStreamParser().feed(cached):
+                        on_fragment(obj)
+                return cached, None
         self._ensure_openai()
         assert self._openai is not None
         started = time.time()
@@ -504,54 +1446,248 @@ class LLMClient:
                 )
             except Exception:
                 pass
-        # 1) Prefer new Responses shape: text.format (object form)
-        try:
-            kwargs = dict(base_kwargs)
-            # Newer SDKs expect an object for text.format, not a bare string
-            # https://platform.openai.com/docs/guides/structured-outputs
-            kwargs["text"] = {"format": {"type": "json_object"}}
-            resp = self._openai.responses.create(**kwargs)
-        except Exception:
-            # 2) Fallback: older Responses accepting response_format
-            try:
-                kwargs = dict(base_kwargs)
-                kwargs["response_format"] = {"type": "json_object"}
-                resp = self._openai.responses.create(**kwargs)
-            except Exception:
-                # 3) Last resort: remove hints; also drop `store` if unsupported
+        # для TPM считаем как провайдер: вход по оценке плюс весь max_output_tokens
+        cost = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + int(self.max_tokens or 0)
+        if self.stream:
+            base_kwargs["stream"] = True
+        resp, shape, retries, throttled = self._create(base_kwargs, cost)
+        timing: Dict[str, Any] = {}
+        if self.stream:
+            content, resp, first_token, first_fragment = self._read_stream(resp, on_fragment)
+            timing = {
+                "ttft_sec": first_token - started - throttled if first_token else None,
+                "ttff_sec": first_fragment - started - throttled if first_fragment else None,
+            }
+        else:
+            # Official SDKs expose a convenience aggregator for text outputs
+            content = getattr(resp, "output_text", None)
+            if not content:
                 try:
-                    resp = self._openai.responses.create(**base_kwargs)
+                    # Fallback to raw structure if needed
+                    content = resp.output[0].content[0].text
                 except Exception:
-                    kwargs2 = dict(base_kwargs)
-                    kwargs2.pop("store", None)
-                    resp = self._openai.responses.create(**kwargs2)
-        latency = time.time() - started
-        # Official SDKs expose a convenience aggregator for text outputs
-        content = getattr(resp, "output_text", None)
-        if not content:
-            try:
-                # Fallback to raw structure if needed
-                content = resp.output[0].content[0].text
-            except Exception:
-                content = "{}"
-
-        # Логируем
-        if self.log_path:
-            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
-            with open(self.log_path, "a", encoding="utf-8") as f:
-                rec = {
-                    "ts": time.time(),
-                    "latency_sec": latency,
-                    "model": self.model,
-                    "temperature": self.temperature,
-                    "max_tokens": self.max_tokens,
-                    "system": system_prompt,
-                    "user": user_prompt[:5000],  # не храним очень длинный
-                    "response": content[:100000],
-                }
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    content = "{}"
+            if on_fragment is not None:
+                for obj in FragmentStreamParser().feed(content):
+                    on_fragment(obj)
+        latency = time.time() - started - throttled
+
+        usage = response_usage(resp)
+        if self.stream and resp is None:
+            usage["finish_reason"] = "interrupted"
+        rec = {
+            "ts": time.time(),
+            "latency_sec": latency,
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "request_key": key,
+            **usage,
+            "retries": retries,
+            "shape": shape,
+            **timing,
+        }
+        if throttled:
+            rec["throttled_sec"] = round(throttled, 3)
+        with self._log_lock:
+            self.calls.append(dict(rec, cached=False))
+        # Логируем (запись на диск — в фоне, см. CallLogWriter)
+        if self.log_writer is not None:
+            rec.update({
+                "user": user_prompt[:5000],  # не храним очень длинный
+                "response": content[:100000],
+            })
+            self.log_writer.write(rec, system_prompt)
+
+        # в кэш — только завершённые ответы: обрезанный, оборванный, failed или отфильтрованный
+        # из кэша вернулся бы без finish_reason и сошёл бы за полный
+        if self.cache is not None and _is_complete(usage["finish_reason"]):
+            self.cache.put(key, content)
+        return content, usage["finish_reason"]
+
+    def _read_stream(
+        self,
+        events: Any,
+        on_fragment: Optional[Callable[[Dict[str, Any]], None]],
+    ) -> Tuple[str, Any, Optional[float], Optional[float]]:
+        """
+        Читает поток событий Responses API: копит текст из response.output_text.delta и по ходу
+        отдаёт закрывшиеся фрагменты в on_fragment. Возвращает (текст, итоговый ответ или None,
+        время первого токена, время первого фрагмента). Обрыв потока не исключение: возвращается то,
+        что успело прийти, а ответ — None (finish_reason станет "interrupted").
+        """
+        parser = FragmentStreamParser()
+        parts: List[str] = []
+        final = None
+        first_token = first_fragment = None
+        try:
+            for event in events:
+                etype = _field(event, "type")
+                if etype == "response.output_text.delta":
+                    delta = _field(event, "delta") or ""
+                    if first_token is None:
+                        first_token = time.time()
+                    parts.append(delta)
+                    for obj in parser.feed(delta):
+                        if first_fragment is None:
+                            first_fragment = time.time()
+                        if on_fragment is not None:
+                            on_fragment(obj)
+                elif etype in ("response.completed", "response.incomplete", "response.failed"):
+                    final = _field(event, "response")
+        except Exception as e:
+            logging.getLogger(__name__).warning("LLM stream interrupted: %s", e)
+        content = "".join(parts)
+        if not content and final is not None:
+            content = getattr(final, "output_text", None) or "{}"
+        return content, final, first_token, first_fragment
+
+    def _create(self, base_kwargs: Dict[str, Any], cost: int = 0) -> Tuple[Any, str, int, float]:
+        """
+        Отправляет запрос в первой рабочей форме; возвращает (ответ, имя формы, число неудачных попыток,
+        секунды ожидания RateLimiter). Каждая попытка забирает из лимита один запрос и `cost` токенов.
+        Сработавшая форма запоминается для модели (см. RequestShapeMemo), и следующие вызовы идут сразу в неё.
+        Ошибка формы (400/422, неизвестный аргумент SDK) переводит к следующей форме; временная ошибка
+        (429, 5xx, таймаут, обрыв соединения) повторяется в той же форме с экспоненциальной паузой
+        и форму не понижает.
+        """
+        # 1) Prefer new Responses shape: text.format (object form)
+        # Newer SDKs expect an object for text.format, not a bare string
+        # https://platform.openai.com/docs/guides/structured-outputs
+        text_format = dict(base_kwargs, text={"format": {"type": "json_object"}})
+        # 2) Fallback: older Responses accepting response_format
+        response_format = dict(base_kwargs, response_format={"type": "json_object"})
+        # 3) Last resort: remove hints; also drop `store` if unsupported
+        no_store = dict(base_kwargs)
+        no_store.pop("store", None)
+        shapes = [
+            ("text.format", text_format),
+            ("response_format", response_format),
+            ("plain", base_kwargs),
+            ("plain_no_store", no_store),
+        ]
+        known = self.shape_memo.get(self.model)
+        shapes.sort(key=lambda x: x[0] != known)  # запомненная форма — первой, остальные в прежнем порядке
+        failures = 0
+        throttled = 0.0
+        last_error: Optional[BaseException] = None
+        for name, kwargs in shapes:
+            for attempt in range(self.transient_retries + 1):
+                if self.rate_limiter is not None:
+                    throttled += self.rate_limiter.acquire(cost)
+                try:
+                    resp = self._openai.responses.create(**kwargs)
+                except Exception as e:
+                    failures += 1
+                    last_error = e
+                    if not is_transient_error(e):
+                        break  # форма не подходит — пробуем следующую
+                    if attempt == self.transient_retries:
+                        raise
+                    time.sleep(self.backoff_sec * (2 ** attempt))
+                    continue
+                if name != known:
+                    self.shape_memo.set(self.model, name)
+                return resp, name, failures, throttled
+        assert last_error is not None
+        raise last_error
+
+    def telemetry(self, wall_sec: Optional[float] = None) -> Dict[str, Any]:
+        with self._log_lock:
+            calls = list(self.calls)
+        return summarize_calls(calls, wall_sec)
+
+
+# --------- Параллельная отправка окон ---------
+Window = Tuple[int, int, str, int]  # (start_offset, end_offset, chunk_text, chunk_index)
+
+
+def dispatch_windows(
+    client: LLMClient,
+    system_prompt: Union[str, Callable[[Window], str]],
+    windows: Iterable[Window],
+    concurrency: int = 1,
+    executor: Optional[ThreadPoolExecutor] = None,
+    on_fragment: Optional[Callable[[Window, Dict[str, Any]], None]] = None,
+) -> Iterator[Tuple[Window, str, Optional[str]]]:
+    """
+    Отправляет окна в LLM, держа в полёте до `concurrency` запросов одновременно.
+    Ответы (окно, текст, finish_reason) отдаются строго в порядке chunk_index,
+    поэтому дальнейшая сборка фрагментов совпадает с последовательным прогоном.
+    system_prompt — общий промпт или функция окно -> промпт (см. SchemaRouter).
+    executor — общий пул потоков (пакетный режим: окна многих документов на одних воркерах);
+    без него пул создаётся на время вызова.
+    on_fragment(окно, объект) вызывается для каждого фрагмента, как только он закрылся в ответе
+    (в потоковом режиме — до конца ответа; из потока воркера, не по порядку окон).
+    """
+    prompt_for = system_prompt if callable(system_prompt) else (lambda w: system_prompt)
+
+    def call(w: Window) -> Tuple[str, Optional[str]]:
+        cb = (lambda obj: on_fragment(w, obj)) if on_fragment is not None else None
+        return client.chat_result(prompt_for(w), build_user_prompt(w[2], w[0]), cb)
+
+    if executor is None and concurrency <= 1:
+        for w in windows:
+            yield (w,) + call(w)
+        return
+    with nullcontext(executor) if executor is not None else ThreadPoolExecutor(max_workers=concurrency) as ex:
+        pending = []
+        it = iter(windows)
+        for w in it:
+            pending.append((w, ex.submit(call, w)))
+            if len(pending) >= concurrency * 2:
+                break
+        while pending:
+            w, fut = pending.pop(0)
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, ex.submit(call, nxt)))
+            yield (w,) + fut.result()
 
-        return content
+
+# --------- Чекпоинты окон ---------
+class WindowCheckpoint:
+    """
+    Распарсенные ответы LLM по окнам (windows.jsonl в каталоге запуска).
+    Строка пишется сразу после обработки окна; ключ — request_key окна,
+    так что при смене промпта/модели/границ окна старая запись не подхватится.
+    Оборванная последняя строка (падение посреди записи) при загрузке пропускается.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            valid = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    valid += len(line)
+                    try:
+                        rec = json.loads(line)
+                        self.done[rec["key"]] = rec["obj"]
+                    except Exception:
+                        continue
+            if valid != os.path.getsize(path):
+                # отрезаем недописанный хвост, чтобы следующая запись начиналась с новой строки
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.done.get(key)
+
+    def save(self, key: str, window: Window, obj: Dict[str, Any], schemas: Optional[List[str]] = None) -> None:
+        start, end, _, idx = window
+        rec = {"key": key, "chunk_index": idx, "start": start, "end": end, "obj": obj}
+        if schemas is not None:
+            # окно спрашивали с урезанным набором схем (SchemaRouter); ключ уже учитывает этот промпт
+            rec["schemas"] = schemas
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.done[key] = obj
 
 
 # --------- Парсер JSON из LLM ---------
@@ -576,6 +1712,148 @@ def parse_llm_json(payload: str) -> Dict[str, Any]:
     return json.loads(payload)
 
 
+def json_tail_open(payload: str) -> bool:
+    """
+    True, если JSON в ответе оборван: после первой '{' остались незакрытые скобки или строка.
+    Так выглядит ответ, упёршийся в max_output_tokens, даже когда finish_reason не пришёл.
+    """
+    start = payload.find("{")
+    if start == -1:
+        return False
+    depth = 0
+    in_str = esc = False
+    for ch in payload[start:]:
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+    return in_str or depth > 0
+
+
+_JSON_SPECIAL_RE = re.compile(r'["{}\[\]]')
+_JSON_STR_SPECIAL_RE = re.compile(r'["\\]')
+
+
+class FragmentStreamParser:
+    """
+    Инкрементальный разбор ответа {"fragments": [{...}, {...}], ...}: feed(кусок текста) возвращает
+    объекты массива fragments, закрывшиеся в этом куске. Текст до первой '{' и всё после закрытия
+    массива игнорируются, так что мусор вокруг JSON не мешает, а обрезанный ответ отдаёт все фрагменты,
+    которые успели закрыться. complete — массив fragments закрыт (список полный).
+    В буфере держится только незакрытый хвост (текущий объект или ключ), а не весь ответ.
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._key_start = -1  # начало строки-ключа верхнего уровня в _buf
+        self._key: Optional[str] = None
+        self._in_array = False
+        self._obj_start = -1  # начало текущего объекта-фрагмента в _buf
+        self.complete = False
+        self.closed = False  # разбор окончен (массив или весь объект закрыт)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if self.closed or not chunk:
+            return []
+        buf = self._buf + chunk
+        n = len(buf)
+        i = len(self._buf)
+        out: List[Dict[str, Any]] = []
+        depth, in_str = self._depth, self._in_str
+        if self._esc:
+            self._esc = False
+            i += 1
+        while i < n:
+            if in_str:
+                m = _JSON_STR_SPECIAL_RE.search(buf, i)
+                if m is None:
+                    i = n
+                    break
+                j = m.start()
+                if buf[j] == "\\":
+                    if j + 1 >= n:
+                        self._esc = True
+                        i = n
+                        break
+                    i = j + 2
+                    continue
+                in_str = False
+                if self._key_start >= 0:
+                    self._key = buf[self._key_start + 1 : j]
+                    self._key_start = -1
+                i = j + 1
+                continue
+            if depth == 0:
+                j = buf.find("{", i)
+                if j == -1:
+                    i = n
+                    break
+                depth = 1
+                i = j + 1
+                continue
+            m = _JSON_SPECIAL_RE.search(buf, i)
+            if m is None:
+                i = n
+                break
+            j = m.start()
+            ch = buf[j]
+            i = j + 1
+            if ch == '"':
+                in_str = True
+                if depth == 1:
+                    self._key_start = j
+            elif ch in "{[":
+                depth += 1
+                if depth == 2 and ch == "[" and self._key == "fragments":
+                    self._in_array = True
+                elif depth == 3 and ch == "{" and self._in_array:
+                    self._obj_start = j
+            else:
+                if depth == 3 and ch == "}" and self._obj_start >= 0:
+                    try:
+                        obj = json.loads(buf[self._obj_start : j + 1])
+                    except Exception:
+                        obj = None
+                    if isinstance(obj, dict):
+                        out.append(obj)
+                    self._obj_start = -1
+                elif depth == 2 and self._in_array:
+                    self._in_array = False
+                    self.complete = self.closed = True
+                depth -= 1
+                if depth == 0:
+                    self.closed = True
+                if self.closed:
+                    break
+        self._depth, self._in_str = depth, in_str
+        # отбрасываем разобранное: храним только незакрытый объект или ключ
+        keep = min((p for p in (self._obj_start, self._key_start) if p >= 0), default=i)
+        self._buf = buf[keep:]
+        if self._obj_start >= 0:
+            self._obj_start -= keep
+        if self._key_start >= 0:
+            self._key_start -= keep
+        return out
+
+
+def salvage_fragments(payload: str) -> Tuple[List[Dict[str, Any]], bool]:
+    """Закрытые объекты fragments из битого/обрезанного ответа и признак, что массив закрыт."""
+    parser = FragmentStreamParser()
+    return parser.feed(payload), parser.complete
+
+
 # --------- Обработка ответа LLM в фрагменты ---------
 def to_fragments_from_chunk(
     chunk_json: Dict[str, Any],
@@ -665,37 +1943,58 @@ def merge_fragments(frags: List[Fragment], iou_threshold: float = 0.66) -> List[
     """
     Сливает близкие/дублирующие фрагменты по IoU и схеме.
     Политика: оставляем фрагмент с большей confidence, накапливаем overlaps.
+
+    Фрагмент сливается с самым ранним (в порядке добавления) оставленным фрагментом
+    той же схемы, у которого IoU >= iou_threshold. Оставленные фрагменты каждой схемы
+    лежат в списке, упорядоченном по start_char; при пороге > 0 проверяются только те,
+    чей start_char попадает в [end - len / iou_threshold, start] — у остальных IoU
+    заведомо ниже порога. Это даёт O(n log n) на реальных данных вместо O(n²).
     """
     frags = sorted(frags, key=lambda x: (x.start_char, x.end_char))
     kept: List[Fragment] = []
+    # schema_id -> отсортированные ключи (start_char, порядковый номер в kept)
+    index: Dict[str, List[Tuple[int, int]]] = {}
     for f in frags:
-        merged = False
-        for k in kept:
-            if f.schema_id != k.schema_id:
-                continue
-            if iou_1d(f.start_char, f.end_char, k.start_char, k.end_char) >= iou_threshold:
-                # сливаем в k
-                if f.confidence > k.confidence:
-                    # заменяем содержимое, но сохраняем overlaps
-                    old_id = k.id
-                    k.id = f.id
-                    k.start_char = f.start_char
-                    k.end_char = f.end_char
-                    k.text = f.text
-                    k.entity_refs = f.entity_refs or k.entity_refs
-                    k.actors = f.actors or k.actors
-                    k.acts = f.acts or k.acts
-                    k.confidence = f.confidence
-                    k.rationale = f.rationale or k.rationale
-                # отмечаем перекрытие
-                if f.id not in k.overlaps:
-                    k.overlaps.append(f.id)
-                if k.id not in f.overlaps:
-                    f.overlaps.append(k.id)
-                merged = True
-                break
-        if not merged:
+        keys = index.setdefault(f.schema_id, [])
+        seq = -1
+        if iou_threshold <= 0:
+            # любой фрагмент той же схемы проходит порог, так что у схемы всего один оставленный
+            if keys:
+                seq = keys[0][1]
+        else:
+            lo = math.floor(f.end_char - (f.end_char - f.start_char) / iou_threshold) - 1
+            pos = bisect.bisect_left(keys, (lo, -1))
+            while pos < len(keys) and keys[pos][0] <= f.start_char:
+                _, cand = keys[pos]
+                k = kept[cand]
+                if (seq == -1 or cand < seq) and iou_1d(f.start_char, f.end_char, k.start_char, k.end_char) >= iou_threshold:
+                    seq = cand
+                pos += 1
+        if seq == -1:
+            keys.append((f.start_char, len(kept)))  # start_char не убывает, список остаётся упорядоченным
             kept.append(f)
+            continue
+        # сливаем в k
+        k = kept[seq]
+        if f.confidence > k.confidence:
+            # заменяем содержимое, но сохраняем overlaps
+            if f.start_char != k.start_char:
+                del keys[bisect.bisect_left(keys, (k.start_char, seq))]
+                bisect.insort(keys, (f.start_char, seq))
+            k.id = f.id
+            k.start_char = f.start_char
+            k.end_char = f.end_char
+            k.text = f.text
+            k.entity_refs = f.entity_refs or k.entity_refs
+            k.actors = f.actors or k.actors
+            k.acts = f.acts or k.acts
+            k.confidence = f.confidence
+            k.rationale = f.rationale or k.rationale
+        # отмечаем перекрытие
+        if f.id not in k.overlaps:
+            k.overlaps.append(f.id)
+        if k.id not in f.overlaps:
+            f.overlaps.append(k.id)
     # Пост-обработка overlaps на всех
     id_map = {f.id: f for f in kept}
     for f in kept:
@@ -704,12 +2003,20 @@ def merge_fragments(frags: List[Fragment], iou_threshold: float = 0.66) -> List[
 
 
 # --------- Пост-линковка причинно-следственных связей ---------
-def link_causals_by_spans(frags: List[Fragment]) -> None:
+def link_causals_by_spans(frags: List[Fragment], min_iou: float = 0.2) -> None:
     """
     Для каждого фрагмента сопоставляет его локальные causal_spans (переведённые в абсолютные координаты)
     с id фрагментов, перекрывающихся этими span'ами. Добавляет в f.causals список ID.
+
+    Фрагменты индексируются по start_char: при min_iou > 0 у кандидата IoU > min_iou возможен,
+    только если его начало лежит в (ce - len / min_iou, ce), так что span проверяет лишь
+    эту полосу, а не все фрагменты. При min_iou <= 0 полоса задаётся индексом по end_char.
     """
     # Индексация по диапазонам
+    by_start = sorted((g.start_char, i) for i, g in enumerate(frags))
+    by_end = sorted((g.end_char, i) for i, g in enumerate(frags))
+    starts = [s for s, _ in by_start]
+    ends = [e for e, _ in by_end]
     for f in frags:
         abs_causals: List[Tuple[int, int]] = []
         base_offset = f._source_window[0]  # глобальный offset окна
@@ -721,58 +2028,96 @@ def link_causals_by_spans(frags: List[Fragment]) -> None:
 
         causals_ids: List[str] = []
         for (cs, ce) in abs_causals:
-            for g in frags:
+            if min_iou > 0:
+                lo = bisect.bisect_right(starts, math.floor(ce - (ce - cs) / min_iou) - 1)
+                hi = bisect.bisect_left(starts, min(ce, f.start_char))
+                candidates = by_start[lo:hi]
+            else:
+                lo = bisect.bisect_right(ends, cs) if min_iou == 0 else 0
+                hi = bisect.bisect_right(ends, f.start_char)
+                candidates = by_end[lo:hi]
+            for _, gi in candidates:
+                g = frags[gi]
                 if g is f:
                     continue
                 # причину ищем раньше по тексту
-                if g.end_char <= f.start_char and iou_1d(cs, ce, g.start_char, g.end_char) > 0.2:
+                if g.end_char <= f.start_char and iou_1d(cs, ce, g.start_char, g.end_char) > min_iou:
                     causals_ids.append(g.id)
         # дедуп
         f.causals = sorted(list(set(causals_ids)), key=lambda x: x)
 
 
 # --------- Экспорт ---------
+def fragment_record(fr: Fragment) -> Dict[str, Any]:
+    return {
+        "id": fr.id,
+        "start_char": fr.start_char,
+        "end_char": fr.end_char,
+        "text": fr.text,
+        "schema_id": fr.schema_id,
+        "schema_type": fr.schema_type,
+        "entity_refs": fr.entity_refs,
+        "actors": fr.actors,
+        "acts": fr.acts,
+        "causals": fr.causals,
+        "confidence": float(f"{fr.confidence:.3f}"),
+        "rationale": fr.rationale[:300],
+        "overlaps": fr.overlaps,
+    }
+
+
 def save_jsonl(path: str, frags: List[Fragment]) -> None:
     with open(path, "w", encoding="utf-8") as f:
         for fr in frags:
-            rec = {
-                "id": fr.id,
-                "start_char": fr.start_char,
-                "end_char": fr.end_char,
-                "text": fr.text,
-                "schema_id": fr.schema_id,
-                "schema_type": fr.schema_type,
-                "entity_refs": fr.entity_refs,
-                "actors": fr.actors,
-                "acts": fr.acts,
-                "causals": fr.causals,
-                "confidence": float(f"{fr.confidence:.3f}"),
-                "rationale": fr.rationale[:300],
-                "overlaps": fr.overlaps,
-            }
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.write(json.dumps(fragment_record(fr), ensure_ascii=False) + "\n")
 
 
 def annotate_markdown(text: str, frags: List[Fragment]) -> str:
     """
     Вставляет невидимые маркеры (HTML-комментарии), чтобы не ломать Markdown.
-    Предпочитаем упорядочивание по start_char DESC, чтобы не сдвигать позиции.
+    Строковый вариант write_annotated_markdown.
     """
-    markers = []
-    for fr in frags:
-        start_tag = (
+    buf = io.StringIO()
+    write_annotated_markdown(buf, text, frags)
+    return buf.getvalue()
+
+
+def _marker_tag(fr: Fragment, is_start: bool) -> str:
+    if is_start:
+        return (
             f"<!-- FRAG id={fr.id} schema={fr.schema_id} conf={fr.confidence:.2f} "
             f"start={fr.start_char} end={fr.end_char} -->"
         )
-        end_tag = f"<!-- /FRAG id={fr.id} -->"
-        markers.append((fr.start_char, True, start_tag))
-        markers.append((fr.end_char, False, end_tag))
+    return f"<!-- /FRAG id={fr.id} -->"
 
-    markers.sort(key=lambda x: (x[0], 0 if x[1] else 1), reverse=True)
-    buf = text
-    for pos, is_start, tag in markers:
-        buf = buf[:pos] + tag + buf[pos:]
-    return buf
+
+def write_annotated_markdown(out: Any, text: str, frags: List[Fragment]) -> None:
+    """
+    Пишет text с маркерами фрагментов в out (путь или текстовый поток) за один проход.
+    Маркеры сортируются один раз, в поток идут срезы текста и теги — документ не копируется
+    на каждый маркер, а теги форматируются по ходу записи.
+
+    Порядок тегов в одной позиции совпадает с прежней вставкой с конца документа:
+    сначала открывающие, потом закрывающие, внутри группы — в обратном порядке фрагментов.
+    Позиции считаются лежащими в [0, len(text)], как их выдаёт to_fragments_from_chunk.
+    """
+    if isinstance(out, str):
+        with open(out, "w", encoding="utf-8") as f:
+            write_annotated_markdown(f, text, frags)
+        return
+    # (позиция, 0 — открывающий / 1 — закрывающий, -номер фрагмента)
+    markers: List[Tuple[int, int, int]] = []
+    for i, fr in enumerate(frags):
+        markers.append((fr.start_char, 0, -i))
+        markers.append((fr.end_char, 1, -i))
+    markers.sort()
+    prev = 0
+    for pos, kind, neg_i in markers:
+        if pos > prev:
+            out.write(text[prev:pos])
+            prev = pos
+        out.write(_marker_tag(frags[-neg_i], kind == 0))
+    out.write(text[prev:])
 
 
 # --------- MOCK-режим (без LLM) ---------
@@ -830,6 +2175,161 @@ def mock_segment(text: str, active_schemas: List[str]) -> List[Fragment]:
     return merge_fragments(frags)
 
 
+# --------- Адаптивное дробление окон ---------
+def split_window(text: str, window: Window, min_chars: int) -> List[Window]:
+    """
+    Делит окно на две части по самой сильной границе (text_breaks) в средней половине окна,
+    при равенстве — ближайшей к середине. Если разрез не по абзацу/заголовку, правая часть
+    начинается с границы предложения/строки чуть раньше разреза (до 1/8 окна), чтобы фрагмент
+    на стыке целиком попал хотя бы в одну часть. Пустой список — окно короче 2*min_chars.
+    """
+    start, end, chunk, idx = window
+    n = end - start
+    if min_chars <= 0 or n < 2 * min_chars:
+        return []
+    mid = n // 2
+    lo, hi = max(min_chars, n // 4), min(n - min_chars, n - n // 4)
+    breaks = text_breaks(chunk)
+    inner = [(b, st) for b, st in breaks if lo <= b <= hi]
+    if inner:
+        cut, strength = max(inner, key=lambda x: (x[1], -abs(x[0] - mid)))
+    else:
+        cut, strength = mid, BREAK_HARD
+    right = cut
+    if strength < BREAK_PARAGRAPH:
+        back = [b for b, _ in breaks if cut - n // 8 <= b < cut]
+        right = back[0] if back else max(1, cut - n // 16)
+    return [
+        (start, start + cut, chunk[:cut], idx),
+        (start + right, end, chunk[right:], idx),
+    ]
+
+
+def _resume_offset(chunk: str, salvaged: List[Dict[str, Any]]) -> int:
+    """С какого места окна переспрашивать после обрезанного ответа: граница не позже конца последнего фрагмента."""
+    ends = []
+    for fr in salvaged:
+        try:
+            ends.append(int(fr["end"]))
+        except Exception:
+            continue
+    if not ends:
+        return 0
+    last = min(max(ends), len(chunk))
+    return max((b for b, st in text_breaks(chunk) if b <= last and st >= BREAK_SENTENCE), default=0)
+
+
+def _shift_fragments(obj: Dict[str, Any], shift: int) -> List[Dict[str, Any]]:
+    """Фрагменты ответа под-окна с offset'ами, пересчитанными относительно родительского окна."""
+    out: List[Dict[str, Any]] = []
+    objects = obj.get("fragments", [])
+    if not isinstance(objects, list):
+        return out
+    for fr in objects:
+        try:
+            fr = dict(fr, start=int(fr["start"]) + shift, end=int(fr["end"]) + shift)
+        except Exception:
+            continue
+        spans = fr.get("causal_spans")
+        if isinstance(spans, list):
+            shifted = []
+            for it in spans:
+                try:
+                    shifted.append([int(it[0]) + shift, int(it[1]) + shift])
+                except Exception:
+                    continue
+            fr["causal_spans"] = shifted
+        out.append(fr)
+    return out
+
+
+def resolve_window(
+    client: LLMClient,
+    system_prompt: str,
+    text: str,
+    window: Window,
+    raw: str,
+    finish_reason: Optional[str],
+    min_split_chars: int,
+    concurrency: int,
+    stats: Dict[str, int],
+    errors_path: str,
+    executor: Optional[ThreadPoolExecutor] = None,
+    on_fragment: Optional[Callable[[Window, Dict[str, Any]], None]] = None,
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Разбирает ответ на окно. Если ответ обрезан (finish_reason или незакрытый JSON) или не парсится:
+    - закрытые объекты fragments сохраняются (salvage_fragments); если массив fragments закрыт
+      (мусор только в хвосте ответа), этого достаточно;
+    - иначе переспрашивается только остаток окна — с границы предложения/строки не позже конца
+      последнего сохранённого фрагмента;
+    - если сохранить нечего, окно делится пополам (split_window) — рекурсивно, пока части
+      не короче min_split_chars.
+    При min_split_chars <= 0 окно не переспрашивается вовсе: остаются только сохранённые фрагменты.
+    Фрагменты частей возвращаются в offset'ах исходного окна, так что дальше их обрабатывает обычный
+    to_fragments_from_chunk. Возвращает (объект ответа, полнота): False — какая-то часть так и не разобралась
+    или ответ с целым JSON завершился не штатно (content_filter, failed, interrupted).
+    """
+    start, end, chunk, idx = window
+    try:
+        obj = parse_llm_json(raw)
+    except Exception as e:
+        problem = f"{'truncated' if json_tail_open(raw) else 'JSON parse error'}: {e}"
+    else:
+        if not _is_truncated(finish_reason) and not json_tail_open(raw):
+            if finish_reason is None or _is_complete(finish_reason):
+                return obj, True
+            # content_filter/failed/interrupted: JSON цел, но ответ не дошёл до конца —
+            # окно не сохраняется в чекпоинт, и следующий запуск спросит его заново
+            with open(errors_path, "a", encoding="utf-8") as ef:
+                ef.write(f"[chunk {idx} offset {start}-{end}] incomplete (finish_reason={finish_reason})"
+                         f" — kept as is, will be re-fetched\n{raw[:2000]}\n\n")
+            return obj, False
+        problem = f"truncated (finish_reason={finish_reason})"
+    salvaged, closed = salvage_fragments(raw)
+    stats["salvaged"] = stats.get("salvaged", 0) + len(salvaged)
+    parts: List[Window] = []
+    covered = closed  # сохранённые фрагменты покрывают окно целиком
+    if closed:
+        action = f"recovered {len(salvaged)} fragments"
+    else:
+        # битый ответ не должен переживать запуск в кэше
+        client.forget(system_prompt, build_user_prompt(chunk, start))
+        resume = _resume_offset(chunk, salvaged)
+        if resume >= len(chunk):
+            covered = True
+            action = f"kept {len(salvaged)} fragments covering the window"
+        elif min_split_chars <= 0 and salvaged:
+            action = f"kept {len(salvaged)} fragments, no re-ask (min_split_chars=0)"
+        elif resume > 0:
+            parts = [(start + resume, end, chunk[resume:], idx)]
+            action = f"kept {len(salvaged)} fragments, re-asking {start + resume}-{end}"
+            stats["tails"] = stats.get("tails", 0) + 1
+        else:
+            parts = split_window(text, window, min_split_chars)
+            action = f"split into {len(parts)}" if parts else "dropped"
+            if parts:
+                stats["split"] = stats.get("split", 0) + 1
+            else:
+                stats["lost"] = stats.get("lost", 0) + 1
+    with open(errors_path, "a", encoding="utf-8") as ef:
+        ef.write(f"[chunk {idx} offset {start}-{end}] {problem} — {action}\n{raw[:2000]}\n\n")
+    if not parts:
+        return {"fragments": salvaged}, covered
+    merged: List[Dict[str, Any]] = list(salvaged)
+    complete = True
+    replies = dispatch_windows(client, system_prompt, parts, concurrency, executor, on_fragment)
+    for part, part_raw, part_finish in replies:
+        stats["fetched"] = stats.get("fetched", 0) + 1
+        part_obj, part_complete = resolve_window(
+            client, system_prompt, text, part, part_raw, part_finish,
+            min_split_chars, concurrency, stats, errors_path, executor, on_fragment,
+        )
+        merged.extend(_shift_fragments(part_obj, part[0] - start))
+        complete = complete and part_complete
+    return {"fragments": merged, "split": True}, complete
+
+
 # --------- Основной пайплайн ---------
 def run_pipeline(
     md_path: str,
@@ -841,6 +2341,25 @@ def run_pipeline(
     window_chars: int,
     overlap_chars: int,
     mock: bool,
+    concurrency: int = 1,
+    cache: Optional[ResponseCache] = None,
+    postprocess_only: bool = False,
+    merge_iou: float = 0.66,
+    causal_iou: float = 0.2,
+    windowing: str = "chars",
+    window_tokens: int = 2000,
+    overlap_tokens: int = 200,
+    log_gzip: bool = False,
+    log_max_mb: float = 64,
+    shape_memo: Optional[RequestShapeMemo] = None,
+    min_split_chars: int = 500,
+    schema_routing: bool = False,
+    route_margin: int = 2,
+    route_threshold: float = 2.0,
+    route_audit: float = 0.0,
+    rate_limiter: Optional[RateLimiter] = None,
+    executor: Optional[ThreadPoolExecutor] = None,
+    stream: bool = False,
 ) -> str:
     with open(md_path, "r", encoding="utf-8") as f:
         text = f.read()
@@ -849,43 +2368,168 @@ def run_pipeline(
     run_dir = os.path.join(outdir, run_id[:12])
     os.makedirs(run_dir, exist_ok=True)
 
-    log_path = os.path.join(run_dir, "llm_calls.jsonl")
+    log_path = os.path.join(run_dir, "llm_calls.jsonl.gz" if log_gzip else "llm_calls.jsonl")
     system_prompt = build_system_prompt(active_schemas)
 
     all_frags: List[Fragment] = []
+    windows_stats: Dict[str, int] = {}
+    routing_stats: Dict[str, Any] = {}
+    stream_stats: Dict[str, Any] = {}
+    telemetry: Optional[Dict[str, Any]] = None
     if mock:
         # офлайн
         all_frags = mock_segment(text, active_schemas)
     else:
-        client = LLMClient(model=model, temperature=temperature, max_tokens=max_tokens, log_path=log_path)
-        for start, end, chunk, idx in window_iter(text, window_chars, overlap_chars):
-            user_prompt = build_user_prompt(chunk, start)
-            raw = client.chat(system_prompt, user_prompt)
-            try:
-                obj = parse_llm_json(raw)
-            except Exception as e:
-                # логируем и продолжаем
-                with open(os.path.join(run_dir, "errors.log"), "a", encoding="utf-8") as ef:
-                    ef.write(f"[chunk {idx} offset {start}] JSON parse error: {e}\n{raw[:2000]}\n\n")
-                obj = {"fragments": []}
-
-            frs = to_fragments_from_chunk(obj, idx, start, text)
-            all_frags.extend(frs)
+        # --postprocess-only не ходит в LLM: ни клиента, ни журнала вызовов
+        log_writer = None if postprocess_only else CallLogWriter(log_path, max_bytes=int(log_max_mb * 1024 * 1024))
+        client: Optional[LLMClient] = None
+        sink: Optional[io.TextIOBase] = None
+        own_pool: Optional[ThreadPoolExecutor] = None
+        if executor is None and concurrency > 1 and not postprocess_only:
+            # один пул на документ, как общий в пакетном режиме: переспросы и деления окон
+            # (resolve_window) идут на тех же воркерах, и в полёте не больше concurrency запросов
+            executor = own_pool = ThreadPoolExecutor(max_workers=concurrency)
+        # журнал (фоновый поток), sink и пул закрываются и при исключении — иначе в пакетном режиме
+        # каждый упавший документ оставлял бы поток и открытый файл
+        try:
+            if not postprocess_only:
+                client = LLMClient(
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    cache=cache,
+                    log_writer=log_writer,
+                    shape_memo=shape_memo,
+                    rate_limiter=rate_limiter,
+                    stream=stream,
+                )
+            checkpoint = WindowCheckpoint(os.path.join(run_dir, "windows.jsonl"))
+            if windowing == "structure":
+                windows = list(structured_window_iter(text, window_tokens, overlap_tokens))
+            else:
+                windows = list(window_iter(text, window_chars, overlap_chars))
+            router = (
+                SchemaRouter(active_schemas, margin=route_margin, threshold=route_threshold, doc_text=text)
+                if schema_routing else None
+            )
+            routed = [router.route(w[2]) for w in windows] if router else [active_schemas] * len(windows)
+            prompts = [router.system_prompt(r) for r in routed] if router else [system_prompt] * len(windows)
+            prompt_by_window = {w[:2]: p for w, p in zip(windows, prompts)}
+            keys = [
+                request_key(model, temperature, max_tokens, p, build_user_prompt(w[2], w[0]))
+                for w, p in zip(windows, prompts)
+            ]
+            missing = [w for w, k in zip(windows, keys) if checkpoint.get(k) is None]
+            windows_stats = {
+                "total": len(windows),
+                "resumed": len(windows) - len(missing),
+                "fetched": 0,
+                "split": 0,
+                "lost": 0,
+                "input_tokens_est": sum(estimate_tokens(w[2]) for w in windows),
+            }
+            if postprocess_only:
+                if missing:
+                    print(f"[WARN] {len(missing)} of {len(windows)} windows have no checkpoint — skipped", file=sys.stderr)
+                missing = []
+            if router is not None:
+                routing_stats = {
+                    "margin": route_margin,
+                    "threshold": route_threshold,
+                    "schemas_avg": round(sum(map(len, routed)) / len(windows), 2) if windows else None,
+                    "prompt_variants": len(set(prompts)),
+                    "system_tokens_est": sum(map(estimate_tokens, prompts)),
+                    "system_tokens_full_est": estimate_tokens(system_prompt) * len(windows),
+                }
+            llm_started = time.time()
+            on_fragment = None
+            if stream and not postprocess_only:
+                # сырые фрагменты в порядке прихода (до слияния): читатель может начинать, не дожидаясь конца прогона
+                sink = open(os.path.join(run_dir, "fragments.stream.jsonl"), "w", encoding="utf-8")
+                sink_lock = threading.Lock()
+                stream_stats = {"fragments": 0, "first_fragment_sec": None}
+
+                def on_fragment(w: Window, obj: Dict[str, Any]) -> None:
+                    frs = to_fragments_from_chunk({"fragments": [obj]}, w[3], w[0], text)
+                    with sink_lock:
+                        if stream_stats["first_fragment_sec"] is None:
+                            stream_stats["first_fragment_sec"] = round(time.time() - llm_started, 3)
+                        for fr in frs:
+                            sink.write(json.dumps(fragment_record(fr), ensure_ascii=False) + "\n")
+                        sink.flush()
+                        stream_stats["fragments"] += len(frs)
+
+            fetched = dispatch_windows(
+                client, lambda w: prompt_by_window[w[:2]], missing, concurrency, executor, on_fragment,
+            ) if client is not None else iter(())
+
+            for w, key, schemas, prompt in zip(windows, keys, routed, prompts):
+                start, end, chunk, idx = w
+                obj = checkpoint.get(key)
+                if obj is None:
+                    if postprocess_only:
+                        continue
+                    _, raw, finish_reason = next(fetched)
+                    windows_stats["fetched"] += 1
+                    obj, complete = resolve_window(
+                        client, prompt, text, w, raw, finish_reason,
+                        min_split_chars, concurrency, windows_stats, os.path.join(run_dir, "errors.log"),
+                        executor, on_fragment,
+                    )
+                    # неполное окно не сохраняем — при следующем запуске его переспросят (удачные части — из кэша)
+                    if complete:
+                        checkpoint.save(key, w, obj, schemas if router else None)
+
+                frs = to_fragments_from_chunk(obj, idx, start, text)
+                all_frags.extend(frs)
+
+            if router is not None and route_audit > 0 and client is not None:
+                # контрольная выборка: те же окна с полным промптом; что нашлось сверх маршрута — пропуски
+                audited = [
+                    i for i, k in enumerate(keys)
+                    if len(routed[i]) < len(active_schemas) and int(k[:8], 16) < route_audit * 0x100000000
+                ]
+                # ответы проходят тот же разбор, что и обычные окна (salvage, хвост, деление); окно,
+                # которое так и не разобралось целиком, в выборку не идёт, но учитывается в skipped
+                samples = []
+                skipped = 0
+                audit_stats: Dict[str, int] = {}
+                replies = dispatch_windows(client, system_prompt, [windows[i] for i in audited], concurrency, executor)
+                for i, (w, raw, finish_reason) in zip(audited, replies):
+                    obj, complete = resolve_window(
+                        client, system_prompt, text, w, raw, finish_reason,
+                        min_split_chars, concurrency, audit_stats, os.path.join(run_dir, "errors.log"), executor,
+                    )
+                    if not complete:
+                        skipped += 1
+                        continue
+                    samples.append((routed[i], [f.schema_id for f in to_fragments_from_chunk(obj, w[3], w[0], text)]))
+                routing_stats["audit"] = dict(
+                    routing_false_negatives(samples), rate=route_audit, sampled=len(audited), skipped=skipped,
+                    recovery=audit_stats,
+                )
+            if client is not None:
+                telemetry = client.telemetry(wall_sec=time.time() - llm_started)
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown(cancel_futures=True)
+            if log_writer is not None:
+                log_writer.close()
+            if sink is not None:
+                sink.close()
 
     # Слияние/дедуп
-    all_frags = merge_fragments(all_frags)
+    all_frags = merge_fragments(all_frags, iou_threshold=merge_iou)
 
     # Пост-линковка причинностей
-    link_causals_by_spans(all_frags)
+    link_causals_by_spans(all_frags, min_iou=causal_iou)
 
     # Экспорт
     jsonl_path = os.path.join(run_dir, "fragments.jsonl")
     save_jsonl(jsonl_path, all_frags)
 
-    annotated_md = annotate_markdown(text, all_frags)
     annotated_path = os.path.join(run_dir, "annotated.md")
-    with open(annotated_path, "w", encoding="utf-8") as f:
-        f.write(annotated_md)
+    write_annotated_markdown(annotated_path, text, all_frags)
 
     # Метаданные запуска
     meta = {
@@ -894,25 +2538,267 @@ def run_pipeline(
         "model": model,
         "temperature": temperature,
         "max_tokens": max_tokens,
+        "windowing": windowing,
         "window_chars": window_chars,
         "overlap_chars": overlap_chars,
+        "window_tokens": window_tokens,
+        "overlap_tokens": overlap_tokens,
+        "concurrency": concurrency,
+        "merge_iou": merge_iou,
+        "causal_iou": causal_iou,
+        "min_split_chars": min_split_chars,
+        "schema_routing": schema_routing,
+        "stream": stream,
         "mock": mock,
+        "postprocess_only": postprocess_only,
         "fragments_count": len(all_frags),
         "run_dir": os.path.abspath(run_dir),
         "run_id": run_id,
         "ts": time.time(),
     }
-    with open(os.path.join(run_dir, "run.json"), "w", encoding="utf-8") as f:
+    if windows_stats:
+        meta["windows"] = windows_stats
+    if routing_stats:
+        meta["routing"] = routing_stats
+    if stream_stats:
+        meta["streaming"] = stream_stats
+    if telemetry is not None:
+        meta["telemetry"] = telemetry
+    if cache is not None:
+        meta["llm_cache"] = cache.stats()
+    meta_path = os.path.join(run_dir, "run.json")
+    if postprocess_only and os.path.exists(meta_path):
+        # run.json описывает прогон с LLM (телеметрия, окна, кэш) — его не затираем;
+        # пороги пересборки и её результат идут отдельным разделом
+        with open(meta_path, "r", encoding="utf-8") as f:
+            prev = json.load(f)
+        prev["fragments_count"] = len(all_frags)
+        prev["postprocess"] = {
+            "merge_iou": merge_iou,
+            "causal_iou": causal_iou,
+            "fragments_count": len(all_frags),
+            "windows_skipped": windows_stats.get("total", 0) - windows_stats.get("resumed", 0),
+            "ts": meta["ts"],
+        }
+        meta = prev
+    with open(meta_path, "w", encoding="utf-8") as f:
         f.write(json.dumps(meta, ensure_ascii=False, indent=2))
 
     print(f"[OK] Saved fragments to {jsonl_path} and annotated markdown to {annotated_path}")
     return run_dir
 
 
+# --------- Пакетный режим ---------
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """Входные .md: файл как есть, каталог — все *.md в нём (рекурсивно), иначе glob (поддерживает **)."""
+    paths: List[str] = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(pattern, "**", "*.md"), recursive=True)
+        elif os.path.isfile(pattern):
+            found = [pattern]
+        else:
+            found = glob.glob(pattern, recursive=True)
+        paths.extend(sorted(p for p in found if os.path.isfile(p)))
+    seen = set()
+    return [p for p in paths if not (os.path.abspath(p) in seen or seen.add(os.path.abspath(p)))]
+
+
+def is_batch_input(patterns: List[str]) -> bool:
+    return len(patterns) > 1 or any(os.path.isdir(p) or glob.has_magic(p) for p in patterns)
+
+
+def run_batch(
+    md_paths: List[str],
+    outdir: str,
+    jobs: int = 4,
+    concurrency: int = 4,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    **pipeline_kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Прогоняет run_pipeline по многим документам: до `jobs` документов одновременно, а их окна
+    идут в LLM через один общий пул из `concurrency` потоков и один RateLimiter(rpm, tpm).
+    У каждого документа свой run_dir, как при одиночном запуске. Упавший документ не останавливает
+    остальные. Сводка (время, фрагменты, окна, токены, ошибки по документам) пишется в
+    <outdir>/batch_<время>.json и возвращается.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    limiter = RateLimiter(rpm, tpm) if (rpm or tpm) else None
+    started = time.time()
+
+    # документы с одинаковым текстом попали бы в один run_dir — второй не запускаем
+    first_by_hash: Dict[str, str] = {}
+    duplicates: Dict[str, str] = {}
+    for path in md_paths:
+        with open(path, "rb") as f:
+            h = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        if h in first_by_hash:
+            duplicates[path] = first_by_hash[h]
+        else:
+            first_by_hash[h] = path
+
+    def one(path: str) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {"input": os.path.abspath(path)}
+        if path in duplicates:
+            rec.update(status="duplicate", same_as=os.path.abspath(duplicates[path]), seconds=0.0)
+            return rec
+        t0 = time.time()
+        try:
+            run_dir = run_pipeline(
+                path, outdir,
+                concurrency=concurrency, rate_limiter=limiter, executor=pool,
+                **pipeline_kwargs,
+            )
+            with open(os.path.join(run_dir, "run.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            tele = meta.get("telemetry") or {}
+            rec.update(
+                status="ok",
+                run_dir=os.path.abspath(run_dir),
+                fragments=meta.get("fragments_count"),
+                windows=meta.get("windows"),
+                api_calls=tele.get("api_calls"),
+                input_tokens=tele.get("input_tokens"),
+                output_tokens=tele.get("output_tokens"),
+            )
+        except Exception as e:
+            rec.update(status="failed", error=f"{type(e).__name__}: {e}")
+            print(f"[WARN] {path}: {rec['error']}", file=sys.stderr)
+        rec["seconds"] = round(time.time() - t0, 3)
+        return rec
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as docs:
+            results = list(docs.map(one, md_paths))
+    wall = time.time() - started
+
+    def total(name: str) -> Optional[int]:
+        vals = [r[name] for r in results if r.get(name) is not None]
+        return sum(vals) if vals else None
+
+    api_calls = total("api_calls")
+    summary: Dict[str, Any] = {
+        "documents": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "duplicates": len(duplicates),
+        "wall_sec": round(wall, 3),
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "fragments": total("fragments"),
+        "api_calls": api_calls,
+        "input_tokens": total("input_tokens"),
+        "output_tokens": total("output_tokens"),
+        "requests_per_min": round(api_calls * 60 / wall, 1) if api_calls and wall > 0 else None,
+        "rate_limit": limiter.stats() if limiter is not None else None,
+        "docs": results,
+        "ts": time.time(),
+    }
+    path = os.path.join(outdir, time.strftime("batch_%Y%m%d-%H%M%S.json"))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(summary, ensure_ascii=False, indent=2))
+    summary["summary_path"] = os.path.abspath(path)
+    for r in results:
+        note = r.get("error") or r.get("same_as") or f"{r.get('fragments')} fragments"
+        print(f"  {r['status']:<9} {r['seconds']:>8.1f}s  {r['input']}  ({note})")
+    print(f"[OK] Batch: {summary['ok']} ok, {summary['failed']} failed of {len(results)} in {wall:.1f}s; summary in {path}")
+    return summary
+
+
+# --------- Сводка по запускам (stats) ---------
+def _run_dirs(paths: List[str]) -> List[str]:
+    """Каталоги запусков: сами пути (если в них есть run.json или журнал вызовов) или их подкаталоги."""
+    found: List[str] = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not os.path.isdir(path):
+                continue
+            if os.path.exists(os.path.join(path, "run.json")) or call_log_files(path):
+                found.append(path)
+                continue
+            for sub in sorted(os.listdir(path)):
+                d = os.path.join(path, sub)
+                if os.path.isdir(d) and (os.path.exists(os.path.join(d, "run.json")) or call_log_files(d)):
+                    found.append(d)
+    return found
+
+
+def load_run_calls(run_dir: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Записи вызовов из журналов llm_calls*.jsonl[.gz] (без промптов) и run.json каталога запуска."""
+    calls: List[Dict[str, Any]] = []
+    for log_path in call_log_files(run_dir):
+        calls.extend(iter_call_log(log_path, with_prompts=False))
+    meta: Dict[str, Any] = {}
+    meta_path = os.path.join(run_dir, "run.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    return calls, meta
+
+
+def run_stats(paths: List[str]) -> Dict[str, Any]:
+    runs = []
+    all_calls: List[Dict[str, Any]] = []
+    for d in _run_dirs(paths):
+        calls, meta = load_run_calls(d)
+        # попадания в кэш не логируются — берём их число из run.json последнего запуска
+        hits = (meta.get("telemetry") or {}).get("cache_hits") or 0
+        calls = calls + [{"cached": True}] * hits
+        all_calls.extend(calls)
+        summary = summarize_calls(calls, (meta.get("telemetry") or {}).get("wall_sec"))
+        runs.append({
+            "run_dir": d,
+            "input_file": meta.get("input_file"),
+            "model": meta.get("model"),
+            "windows": (meta.get("windows") or {}).get("total"),
+            "fragments_count": meta.get("fragments_count"),
+            **summary,
+        })
+    return {"runs": runs, "total": summarize_calls(all_calls)}
+
+
+def _fmt(x: Any) -> str:
+    return "-" if x is None else str(x)
+
+
+def stats_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="boldsea_segmenter.py stats",
+                                     description="Сводка токенов/задержек по каталогам запусков")
+    parser.add_argument("paths", nargs="+", help="Каталоги запусков, их родители (out/) или glob-шаблоны")
+    parser.add_argument("--json", action="store_true", help="Вывести полный JSON")
+    args = parser.parse_args(argv)
+
+    res = run_stats(args.paths)
+    if args.json:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        return 0
+    if not res["runs"]:
+        print("[WARN] Не найдено ни одного каталога запуска", file=sys.stderr)
+        return 1
+    header = ["run", "calls", "hits", "in_tok", "out_tok", "cached_tok", "p50", "p95", "p99", "trunc", "retries"]
+    rows = []
+    for r in res["runs"] + [dict(res["total"], run_dir="TOTAL")]:
+        lat = r["latency_sec"]
+        rows.append([
+            os.path.basename(os.path.normpath(r["run_dir"])), r["api_calls"], r["cache_hits"], r["input_tokens"],
+            r["output_tokens"], r["cached_tokens"], lat["p50"], lat["p95"], lat["p99"],
+            r["max_output_tokens_hits"], r["retries"],
+        ])
+    widths = [max(len(_fmt(x)) for x in col) for col in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(_fmt(x).rjust(w) if i else _fmt(x).ljust(w) for i, (x, w) in enumerate(zip(row, widths))))
+    return 0
+
+
 # --------- CLI ---------
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "stats":
+        sys.exit(stats_main(sys.argv[2:]))
     parser = argparse.ArgumentParser(description="Boldsea Semantic Segmenter")
-    parser.add_argument("md", help="Путь к входному .md")
+    parser.add_argument("md", nargs="+",
+                        help="Путь к входному .md; несколько путей, каталог или glob — пакетный режим")
     parser.add_argument("--config", help="YAML/JSON с активными схемами и параметрами LLM", default=None)
     parser.add_argument("--active-schemas", help="Через запятую: Definition,Comparison,...", default=None)
     parser.add_argument("--model", default="gpt-5-pro", help="Имя модели LLM")
@@ -920,8 +2806,42 @@ def main():
     parser.add_argument("--max-tokens", type=int, default=1800)
     parser.add_argument("--window-chars", type=int, default=6000)
     parser.add_argument("--overlap-chars", type=int, default=600)
+    parser.add_argument("--windowing", choices=["chars", "structure"], default="chars",
+                        help="chars — фиксированные окна по символам; structure — по бюджету токенов с разрезом по структуре")
+    parser.add_argument("--window-tokens", type=int, default=2000, help="Бюджет окна в оценочных токенах (structure)")
+    parser.add_argument("--overlap-tokens", type=int, default=200, help="Максимальный перехлёст в токенах (structure)")
+    parser.add_argument("--min-split-chars", type=int, default=500,
+                        help="Обрезанный/битый ответ: окно делится пополам, пока части не короче этого (0 — не делить)")
+    parser.add_argument("--schema-routing", action="store_true",
+                        help="Для каждого окна — только правдоподобные схемы в system-промпте (локальный пре-роутер)")
+    parser.add_argument("--route-margin", type=int, default=2,
+                        help="Запас: сколько непрошедших схем добавить (самые сильные по документу)")
+    parser.add_argument("--route-threshold", type=float, default=2.0,
+                        help="Порог оценки схемы в окне: 2 за явный маркер + тематические совпадения на 1000 символов")
+    parser.add_argument("--route-audit", type=float, default=0.0,
+                        help="Доля окон, перепроверяемых с полным промптом для оценки пропусков роутера (0..1)")
     parser.add_argument("--outdir", default="out")
     parser.add_argument("--mock", action="store_true", help="Офлайн эвристики вместо LLM")
+    parser.add_argument("--concurrency", type=int, default=1, help="Сколько окон одновременно отправлять в LLM")
+    parser.add_argument("--stream", action="store_true",
+                        help="Потоковые ответы LLM: фрагменты разбираются по мере прихода (fragments.stream.jsonl)")
+    parser.add_argument("--jobs", type=int, default=4, help="Пакетный режим: сколько документов обрабатывать одновременно")
+    parser.add_argument("--rpm", type=float, default=None, help="Общий лимит запросов к LLM в минуту")
+    parser.add_argument("--tpm", type=float, default=None, help="Общий лимит токенов в минуту (вход по оценке + max_tokens)")
+    parser.add_argument("--cache", default=None, help="SQLite-кэш ответов LLM (по умолчанию <outdir>/llm_cache.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш ответов LLM")
+    parser.add_argument("--cache-max-mb", type=float, default=256, help="Предельный размер кэша, МБ")
+    parser.add_argument("--cache-max-age-days", type=float, default=None, help="Срок жизни записей кэша, дни")
+    parser.add_argument("--seed-cache", action="append", default=[], metavar="GLOB",
+                        help="Наполнить кэш из старых журналов, например 'out/*/llm_calls*.jsonl*'")
+    parser.add_argument("--log-gzip", action="store_true", help="Писать журнал вызовов LLM в llm_calls.jsonl.gz")
+    parser.add_argument("--log-max-mb", type=float, default=64, help="Ротация журнала вызовов LLM по размеру, МБ")
+    parser.add_argument("--shape-cache", default=None,
+                        help="JSON-файл с запомненной формой запроса по модели (иначе только в памяти процесса)")
+    parser.add_argument("--postprocess-only", action="store_true",
+                        help="Без обращений к LLM: пересобрать результат из чекпоинтов окон (windows.jsonl)")
+    parser.add_argument("--merge-iou", type=float, default=0.66, help="Порог IoU для слияния фрагментов одной схемы")
+    parser.add_argument("--causal-iou", type=float, default=0.2, help="Порог IoU для привязки causal_spans")
     args = parser.parse_args()
 
     active_schemas: List[str] = [
@@ -953,6 +2873,18 @@ def main():
     max_tokens = args.max_tokens
     window_chars = args.window_chars
     overlap_chars = args.overlap_chars
+    windowing = args.windowing
+    window_tokens = args.window_tokens
+    overlap_tokens = args.overlap_tokens
+    concurrency = args.concurrency
+    rpm = args.rpm
+    stream = args.stream
+    tpm = args.tpm
+    min_split_chars = args.min_split_chars
+    schema_routing = args.schema_routing
+    route_margin = args.route_margin
+    route_threshold = args.route_threshold
+    route_audit = args.route_audit
 
     if args.config:
         cfg = load_config(args.config) or {}
@@ -964,6 +2896,19 @@ def main():
         win_cfg = cfg.get("windows", {})
         window_chars = int(win_cfg.get("window_chars", window_chars))
         overlap_chars = int(win_cfg.get("overlap_chars", overlap_chars))
+        windowing = win_cfg.get("mode", windowing)
+        window_tokens = int(win_cfg.get("window_tokens", window_tokens))
+        overlap_tokens = int(win_cfg.get("overlap_tokens", overlap_tokens))
+        min_split_chars = int(win_cfg.get("min_split_chars", min_split_chars))
+        concurrency = int(llm_cfg.get("concurrency", concurrency))
+        rpm = llm_cfg.get("rpm", rpm)
+        stream = bool(llm_cfg.get("stream", stream))
+        tpm = llm_cfg.get("tpm", tpm)
+        route_cfg = cfg.get("routing", {})
+        schema_routing = bool(route_cfg.get("enabled", schema_routing))
+        route_margin = int(route_cfg.get("margin", route_margin))
+        route_threshold = float(route_cfg.get("threshold", route_threshold))
+        route_audit = float(route_cfg.get("audit", route_audit))
 
     if args.active_schemas:
         active_schemas = [s.strip() for s in args.active_schemas.split(",") if s.strip()]
@@ -973,9 +2918,28 @@ def main():
         if s not in SCHEMA_LIBRARY:
             print(f"[WARN] Неизвестная схема '{s}' — будет проигнорирована LLM-ом.", file=sys.stderr)
 
-    run_pipeline(
-        md_path=args.md,
-        outdir=args.outdir,
+    if args.postprocess_only and args.mock:
+        parser.error("--postprocess-only не совместим с --mock: в mock-режиме нет чекпоинтов")
+
+    batch = is_batch_input(args.md)
+    md_paths = expand_inputs(args.md) if batch else args.md
+    if not md_paths:
+        parser.error(f"не найдено ни одного .md: {' '.join(args.md)}")
+    rpm = float(rpm) if rpm else None
+    tpm = float(tpm) if tpm else None
+
+    cache: Optional[ResponseCache] = None
+    if not args.no_cache and not args.mock and not args.postprocess_only:
+        cache = ResponseCache(
+            args.cache or os.path.join(args.outdir, "llm_cache.sqlite"),
+            max_bytes=int(args.cache_max_mb * 1024 * 1024),
+            max_age_sec=args.cache_max_age_days * 86400 if args.cache_max_age_days is not None else None,
+        )
+        for pattern in args.seed_cache:
+            n = cache.seed_from_logs(pattern)
+            print(f"[OK] Seeded {n} cached responses from {pattern}")
+
+    pipeline_kwargs: Dict[str, Any] = dict(
         active_schemas=active_schemas,
         model=model,
         temperature=temperature,
@@ -983,7 +2947,42 @@ def main():
         window_chars=window_chars,
         overlap_chars=overlap_chars,
         mock=args.mock,
+        cache=cache,
+        postprocess_only=args.postprocess_only,
+        merge_iou=args.merge_iou,
+        causal_iou=args.causal_iou,
+        windowing=windowing,
+        window_tokens=window_tokens,
+        overlap_tokens=overlap_tokens,
+        log_gzip=args.log_gzip,
+        log_max_mb=args.log_max_mb,
+        shape_memo=RequestShapeMemo(args.shape_cache) if args.shape_cache else None,
+        min_split_chars=min_split_chars,
+        schema_routing=schema_routing,
+        route_margin=route_margin,
+        route_threshold=route_threshold,
+        route_audit=route_audit,
+        stream=stream,
     )
+    failed = False
+    if batch:
+        summary = run_batch(
+            md_paths, args.outdir, jobs=args.jobs, concurrency=concurrency, rpm=rpm, tpm=tpm, **pipeline_kwargs,
+        )
+        failed = summary["failed"] > 0
+    else:
+        run_pipeline(
+            md_path=md_paths[0],
+            outdir=args.outdir,
+            concurrency=concurrency,
+            rate_limiter=RateLimiter(rpm, tpm) if (rpm or tpm) else None,
+            **pipeline_kwargs,
+        )
+    if cache is not None:
+        cache.evict()
+        cache.close()
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock LLM Server
+---------------
+Локальная замена OpenAI API для нагрузочных прогонов без сети и ключа.
+Понимает подмножество, которым пользуются boldsea_segmenter.py и fragment-processor/boldsea_ingest_cli.py:
+- POST /v1/responses          — Responses API (output_text, status/incomplete_details, usage; stream=true — SSE);
+- POST /v1/chat/completions   — Chat Completions (choices[0].message.content, finish_reason, usage);
+- GET  /v1/models, GET /stats — список моделей и счётчики сервера.
+
+Ответы имеют форму ожидаемого JSON: для сегментатора — {"fragments": [...]} со span'ами предложений
+из куска между ``` и схемами из system-промпта; для инжеста — поля из "Extraction fields (output types)".
+
+Пример:
+    python3 mock_llm_server.py --port 8765 --latency lognormal:0.8,0.4 --error-rate-429 0.05 --error-rate-5xx 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python3 boldsea_segmenter.py input.md --concurrency 8
+
+Лицензия: MIT
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+SENTENCE_RE = re.compile(r"[^.!?\n]{20,}[.!?]")
+SCHEMA_LINE_RE = re.compile(r"^\* ([^:\n]+):", re.M)
+FIELDS_RE = re.compile(r"Extraction fields \(output types\): (\{.*\})")
+WORD_RE = re.compile(r"[A-Za-zА-Яа-яЁё][\w\-]{3,}")
+
+
+# --------- Задержки ---------
+def parse_latency(spec: str):
+    """
+    const:S | uniform:A,B | normal:MU,SIGMA | lognormal:MEDIAN,SIGMA | exp:MEAN — секунды.
+    Возвращает функцию rng -> задержка.
+    """
+    kind, _, args = spec.partition(":")
+    vals = [float(x) for x in args.split(",") if x.strip()] if args else []
+    if kind == "const":
+        return lambda rng: vals[0] if vals else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(vals[0], vals[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(vals[0], vals[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(vals[0]), vals[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / vals[0])
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+@dataclass
+class MockConfig:
+    latency: str = "const:0"
+    latency_per_1k_output: float = 0.0  # доп. секунды на 1000 выходных токенов
+    error_rate_429: float = 0.0
+    error_rate_5xx: float = 0.0
+    malformed_rate: float = 0.0
+    truncate_rate: float = 0.0
+    filter_rate: float = 0.0  # доля ответов, оборванных фильтром контента (закрытый JSON без фрагментов)
+    reject_text_format: bool = False
+    seed: Optional[int] = None
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 3)
+
+
+# --------- Генерация содержимого ---------
+def segmenter_payload(system: str, user: str, rng: random.Random) -> Optional[Dict[str, Any]]:
+    if "```" not in user:
+        return None
+    chunk = user.split("```\n", 1)[-1].rsplit("\n```", 1)[0]
+    schemas = SCHEMA_LINE_RE.findall(system) or ["Definition"]
+    frags = []
+    prev: Optional[Tuple[int, int]] = None
+    for m in SENTENCE_RE.finditer(chunk):
+        start = m.start() + (len(m.group()) - len(m.group().lstrip()))
+        words = WORD_RE.findall(m.group())
+        frag = {
+            "start": start,
+            "end": m.end(),
+            "schema_id": rng.choice(schemas),
+            "schema_type": "Fragment",
+            "entity_refs": words[:3],
+            "actors": [],
+            "acts": [],
+            "causal_spans": [list(prev)] if prev and rng.random() < 0.2 else [],
+            "confidence": round(rng.uniform(0.5, 0.95), 2),
+            "rationale": "mock",
+        }
+        frags.append(frag)
+        prev = (start, m.end())
+    return {"fragments": frags, "alternatives": []}
+
+
+def ingest_payload(user: str, rng: random.Random) -> Optional[Dict[str, Any]]:
+    m = FIELDS_RE.search(user)
+    if not m:
+        return None
+    try:
+        fields = json.loads(m.group(1))
+    except Exception:
+        return None
+    text = user.split("Fragment text:\n", 1)[-1]
+    words = list(dict.fromkeys(WORD_RE.findall(text)))
+    out: Dict[str, Any] = {}
+    for name, kind in fields.items():
+        if name == "confidence":
+            out[name] = round(rng.uniform(0.5, 0.95), 2)
+        elif kind.startswith("array"):
+            out[name] = rng.sample(words, min(len(words), rng.randint(0, 3)))
+        else:
+            out[name] = words[0] if words else ""
+    return out
+
+
+def _messages(body: Dict[str, Any]) -> Tuple[str, str]:
+    msgs = body.get("input") if "input" in body else body.get("messages")
+    if isinstance(msgs, str):
+        return "", msgs
+    system, user = [], []
+    for msg in msgs or []:
+        content = msg.get("content", "")
+        if isinstance(content, list):
+            content = "".join(p.get("text", "") for p in content if isinstance(p, dict))
+        (system if msg.get("role") in ("system", "developer") else user).append(content)
+    return "\n".join(system), "\n".join(user)
+
+
+# --------- HTTP ---------
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: Tuple[str, int], cfg: MockConfig):
+        super().__init__(addr, Handler)
+        self.cfg = cfg
+        self.latency = parse_latency(cfg.latency)
+        self._rng = random.Random(cfg.seed)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+
+    def rng(self) -> random.Random:
+        # отдельный генератор на запрос: детерминированно при --seed и без гонок между потоками
+        with self._lock:
+            return random.Random(self._rng.random())
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: MockLLMServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt: str, *args: Any) -> None:  # тишина вместо access-лога
+        pass
+
+    def _send(self, status: int, obj: Any, headers: Optional[Dict[str, str]] = None, raw: Optional[str] = None) -> None:
+        data = (raw if raw is not None else json.dumps(obj, ensure_ascii=False)).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_response(self, resp: Dict[str, Any], text: str, per_token: float, step: int = 48) -> None:
+        """Responses API с stream=true: SSE-события (created, output_text.delta..., completed/incomplete) чанками HTTP/1.1."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        seq = 0
+        item_id = resp["output"][0]["id"]
+
+        def event(obj: Dict[str, Any]) -> None:
+            nonlocal seq
+            obj["sequence_number"] = seq
+            seq += 1
+            data = f"event: {obj['type']}\ndata: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        event({"type": "response.created", "response": dict(resp, status="in_progress", output=[], usage=None)})
+        for i in range(0, len(text), step):
+            piece = text[i : i + step]
+            time.sleep(per_token * estimate_tokens(piece))
+            event({"type": "response.output_text.delta", "item_id": item_id, "output_index": 0,
+                   "content_index": 0, "delta": piece, "logprobs": []})
+        event({"type": "response.output_text.done", "item_id": item_id, "output_index": 0,
+               "content_index": 0, "text": text, "logprobs": []})
+        done = "response.completed" if resp["status"] == "completed" else "response.incomplete"
+        event({"type": done, "response": resp})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+        self.server.count("streamed")
+
+    def _error(self, status: int, message: str, etype: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.server.count(f"status_{status}")
+        self._send(status, {"error": {"message": message, "type": etype, "param": None, "code": None}}, headers)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        elif path.endswith("/stats"):
+            with self.server._lock:
+                self._send(200, dict(self.server.counters))
+        else:
+            self._error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except Exception:
+            self._error(400, "Invalid JSON body", "invalid_request_error")
+            return
+        if path.endswith("/responses"):
+            self._complete(body, api="responses")
+        elif path.endswith("/chat/completions"):
+            self._complete(body, api="chat")
+        else:
+            self._error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def _complete(self, body: Dict[str, Any], api: str) -> None:
+        srv, cfg = self.server, self.server.cfg
+        rng = srv.rng()
+        srv.count(f"requests_{api}")
+        if api == "responses" and cfg.reject_text_format and "text" in body:
+            self._error(400, "Unrecognized request argument supplied: text", "invalid_request_error")
+            return
+
+        system, user = _messages(body)
+        payload = segmenter_payload(system, user, rng) if api == "responses" else None
+        if payload is None:
+            payload = ingest_payload(user, rng)
+        if payload is None:
+            payload = segmenter_payload(system, user, rng) or {"fragments": []}
+        text = json.dumps(payload, ensure_ascii=False)
+
+        limit = body.get("max_output_tokens") or body.get("max_completion_tokens") or body.get("max_tokens")
+        out_tokens = estimate_tokens(text)
+        truncated = False
+        reason = None
+        if cfg.filter_rate and rng.random() < cfg.filter_rate:
+            # фильтр обрывает ответ, но то, что пришло, — корректный JSON
+            text = json.dumps({"fragments": []})
+            out_tokens = estimate_tokens(text)
+            reason = "content_filter"
+        elif rng.random() < cfg.truncate_rate or (limit and out_tokens > int(limit)):
+            # обрезаем посреди JSON, как делает модель при упоре в лимит
+            keep = min(len(text) - 1, int(limit) * 3 if limit else len(text) // 2)
+            text = text[: max(1, min(keep, int(len(text) * rng.uniform(0.3, 0.9))))]
+            out_tokens = estimate_tokens(text)
+            truncated = True
+            reason = "max_output_tokens"
+        elif rng.random() < cfg.malformed_rate:
+            text = "Конечно! Вот результат: " + text[:-1] + ",]"
+            srv.count("malformed")
+
+        # в потоке выходные токены "генерируются" по ходу отдачи, до первого токена — только базовая задержка
+        stream = api == "responses" and bool(body.get("stream"))
+        per_token = cfg.latency_per_1k_output / 1000
+        time.sleep(srv.latency(rng) + (0 if stream else per_token * out_tokens))
+
+        # ошибки решаются после задержки: так ведёт себя перегруженный upstream
+        r = rng.random()
+        if r < cfg.error_rate_429:
+            self._error(429, "Rate limit reached (mock)", "rate_limit_error", {"Retry-After": "1"})
+            return
+        if r < cfg.error_rate_429 + cfg.error_rate_5xx:
+            status = rng.choice([500, 502, 503])
+            self._error(status, "The server is overloaded (mock)", "server_error")
+            return
+
+        in_tokens = estimate_tokens(system) + estimate_tokens(user)
+        if truncated:
+            srv.count("truncated")
+        elif reason:
+            srv.count("filtered")
+        srv.count("status_200")
+        if api == "responses":
+            resp = {
+                "id": f"resp_{uuid.uuid4().hex}",
+                "object": "response",
+                "created_at": int(time.time()),
+                "model": body.get("model", "mock"),
+                "status": "incomplete" if reason else "completed",
+                "incomplete_details": {"reason": reason} if reason else None,
+                "output": [{
+                    "type": "message",
+                    "id": f"msg_{uuid.uuid4().hex}",
+                    "status": "incomplete" if reason else "completed",
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}],
+                }],
+                "usage": {
+                    "input_tokens": in_tokens,
+                    "input_tokens_details": {"cached_tokens": 0},
+                    "output_tokens": out_tokens,
+                    "output_tokens_details": {"reasoning_tokens": 0},
+                    "total_tokens": in_tokens + out_tokens,
+                },
+            }
+            if stream:
+                self._stream_response(resp, text, per_token)
+            else:
+                self._send(200, resp)
+        else:
+            self._send(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": {"max_output_tokens": "length"}.get(reason, reason or "stop"),
+                }],
+                "usage": {
+                    "prompt_tokens": in_tokens,
+                    "completion_tokens": out_tokens,
+                    "total_tokens": in_tokens + out_tokens,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server (Responses + Chat Completions)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="const:0",
+                        help="const:S | uniform:A,B | normal:MU,SIGMA | lognormal:MEDIAN,SIGMA | exp:MEAN (секунды)")
+    parser.add_argument("--latency-per-1k-output", type=float, default=0.0, help="Доп. секунды на 1000 выходных токенов")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Доля ответов с битым JSON (HTTP 200)")
+    parser.add_argument("--truncate-rate", type=float, default=0.0,
+                        help="Доля ответов, обрезанных как при упоре в max_output_tokens (сверх реального лимита)")
+    parser.add_argument("--filter-rate", type=float, default=0.0,
+                        help="Доля ответов, оборванных фильтром контента (incomplete/content_filter, JSON без фрагментов)")
+    parser.add_argument("--reject-text-format", action="store_true",
+                        help="Отвечать 400 на параметр text (проверка перебора форм запроса)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    cfg = MockConfig(
+        latency=args.latency,
+        latency_per_1k_output=args.latency_per_1k_output,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        malformed_rate=args.malformed_rate,
+        truncate_rate=args.truncate_rate,
+        filter_rate=args.filter_rate,
+        reject_text_format=args.reject_text_format,
+        seed=args.seed,
+    )
+    parse_latency(cfg.latency)  # ранняя проверка спецификации
+    server = MockLLMServer((args.host, args.port), cfg)
+    print(f"[OK] Mock LLM server on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("openai")
+
+import boldsea_segmenter as seg
+from mock_llm_server import MockConfig, MockLLMServer
+
+TEXT = "\n\n".join(
+    f"Раздел {i}. Компонент номер {i} обрабатывает входные данные конвейера. "
+    f"Он передаёт результат следующему модулю через общую очередь."
+    for i in range(12)
+)
+
+
+@pytest.fixture
+def mock_server(monkeypatch):
+    server = MockLLMServer(("127.0.0.1", 0), MockConfig(seed=1))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run(md_path, outdir):
+    run_dir = seg.run_pipeline(
+        str(md_path), str(outdir), ["Definition", "Architectural Component"], "mock", 0.2, 1800,
+        window_chars=400, overlap_chars=40, mock=False,
+    )
+    with open(os.path.join(run_dir, "run.json"), encoding="utf-8") as f:
+        return run_dir, json.load(f)
+
+
+def test_content_filtered_window_is_refetched(tmp_path, mock_server):
+    md = tmp_path / "doc.md"
+    md.write_text(TEXT, encoding="utf-8")
+
+    mock_server.cfg.filter_rate = 1.0
+    run_dir, meta = _run(md, tmp_path / "out")
+    total = meta["windows"]["total"]
+    assert total > 1 and meta["windows"]["fetched"] == total
+    assert not os.path.exists(os.path.join(run_dir, "windows.jsonl")) or \
+        os.path.getsize(os.path.join(run_dir, "windows.jsonl")) == 0
+    with open(os.path.join(run_dir, "errors.log"), encoding="utf-8") as f:
+        assert f.read().count("finish_reason=content_filter") == total
+
+    # отфильтрованные окна не попали в чекпоинт: следующий запуск спрашивает их заново
+    mock_server.cfg.filter_rate = 0.0
+    _, meta = _run(md, tmp_path / "out")
+    assert meta["windows"]["resumed"] == 0 and meta["windows"]["fetched"] == total
+
+    _, meta = _run(md, tmp_path / "out")
+    assert meta["windows"]["resumed"] == total and meta["windows"]["fetched"] == 0
+
+
+def test_postprocess_only_keeps_llm_run_meta(tmp_path, mock_server):
+    md = tmp_path / "doc.md"
+    md.write_text(TEXT, encoding="utf-8")
+    run_dir, meta = _run(md, tmp_path / "out")
+    requests = dict(mock_server.counters)
+    log_path = os.path.join(run_dir, "llm_calls.jsonl")
+    log_size = os.path.getsize(log_path)
+
+    seg.run_pipeline(
+        str(md), str(tmp_path / "out"), ["Definition", "Architectural Component"], "mock", 0.2, 1800,
+        window_chars=400, overlap_chars=40, mock=False, postprocess_only=True, merge_iou=0.5,
+    )
+    with open(os.path.join(run_dir, "run.json"), encoding="utf-8") as f:
+        after = json.load(f)
+    assert mock_server.counters == requests
+    assert os.path.getsize(log_path) == log_size
+    assert after["telemetry"] == meta["telemetry"]
+    assert after["windows"] == meta["windows"]
+    assert after["merge_iou"] == meta["merge_iou"]
+    assert after["postprocess"]["merge_iou"] == 0.5
+    assert after["postprocess"]["windows_skipped"] == 0